@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+from statsmodels.tsa.stattools import coint
+
+from basecommander import run_migrations
+from constants import RESOLUTION, MIGRATION_PATH
+from func_cointegration import calculate_cointegration, calculate_cointegration_batch, half_life_mean_reversion, \
+    calculate_zscore, RollingZScore
+from func_database import use_database, store_cointegrated_markets, delete_candles_after, close_connections
+from func_entry_pairs import open_positions
+from func_mock_exchange import MockExchange, SimulatedClock
+from func_pair_scan import find_cointegrated_markets_from_all_markets
+from func_price_matrix import build_price_matrix
+from func_public import get_historical_price_matrix
+from func_utils import set_clock
+
+HOUR_MS = 3_600_000
+SUITE_END_MS = 1_700_000_000_000
+SUITE_MARKETS = (50, 200, 800)
+SUITE_BARS = (400, 2000)
+
+
+# Synthetic close series, some markets listed late so the timestamp index is ragged
+def make_market_series(n_markets, n_bars, seed=0):
+    rng = np.random.default_rng(seed)
+    start = 1_700_000_000_000
+    series_by_market = {}
+    for i in range(n_markets):
+        offset = int(rng.integers(0, n_bars // 10)) if i % 7 == 0 else 0
+        ts = start + np.arange(offset, n_bars, dtype=np.int64) * HOUR_MS
+        closes = np.exp(np.cumsum(rng.normal(0, 0.01, len(ts))))
+        series_by_market[f"M{i}/BTC"] = (ts, closes)
+    return series_by_market
+
+
+# Previous approach: grow the frame with one outer merge per market
+def merge_price_frames(series_by_market):
+    df = None
+    warnings.simplefilter("ignore", pd.errors.PerformanceWarning)
+    for market, (ts, closes) in series_by_market.items():
+        df_add = pd.DataFrame({"datetime": ts, market: closes}).set_index("datetime")
+        df = df_add if df is None else pd.merge(df, df_add, how="outer", on="datetime")
+    return df
+
+
+def timed(func, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_price_matrix(sizes=(100, 500, 1000), n_bars=400):
+    print("Price matrix assembly: outer merge vs columnar build")
+    records = []
+    for n_markets in sizes:
+        series_by_market = make_market_series(n_markets, n_bars)
+        merge_time = timed(merge_price_frames, series_by_market, repeat=1)
+        build_time = timed(lambda s: build_price_matrix(s).to_frame(), series_by_market)
+        print(f"{n_markets:>5} markets x {n_bars} bars: merge {merge_time:8.3f}s  "
+              f"build {build_time:8.4f}s  speedup {merge_time / build_time:8.1f}x")
+        records.append(record("price_matrix_merge", n_markets, n_bars, merge_time))
+        records.append(record("price_matrix_build", n_markets, n_bars, build_time))
+    return records
+
+
+# Per-pair statsmodels test vs one batched call, checking they agree
+def bench_engle_granger(n_candidates=200, n_bars=400, tolerance=1e-6):
+    print("Engle-Granger: per-pair calculate_cointegration vs calculate_cointegration_batch")
+    rng = np.random.default_rng(1)
+    series_1 = np.cumsum(rng.normal(size=n_bars)) + 100
+    related = series_1[:, None] * rng.uniform(0.5, 2, n_candidates // 2) + rng.normal(0, 2, (n_bars, n_candidates // 2))
+    unrelated = np.cumsum(rng.normal(size=(n_bars, n_candidates - n_candidates // 2)), axis=0) + 100
+    block = np.column_stack([related, unrelated])
+
+    started = time.perf_counter()
+    per_pair = [calculate_cointegration(series_1, block[:, k]) for k in range(n_candidates)]
+    per_pair_time = time.perf_counter() - started
+    batch_time = timed(calculate_cointegration_batch, series_1, block)
+
+    flags, hedge_ratios, _, t_stats, p_values = calculate_cointegration_batch(series_1, block)
+    coint_results = [coint(series_1, block[:, k]) for k in range(n_candidates)]
+    hedge_error = max(abs(h - hedge_ratios[k]) / max(1.0, abs(h)) for k, (_, h, _) in enumerate(per_pair))
+    t_error = max(abs(t - t_stats[k]) for k, (t, _, _) in enumerate(coint_results))
+    p_error = max(abs(p - p_values[k]) for k, (_, p, _) in enumerate(coint_results))
+    flag_mismatches = sum(f != flags[k] for k, (f, _, _) in enumerate(per_pair))
+    print(f"{n_candidates:>5} pairs x {n_bars} bars: per-pair {per_pair_time:8.3f}s  batch {batch_time:8.4f}s  "
+          f"speedup {per_pair_time / batch_time:8.1f}x")
+    print(f"      max error vs statsmodels: hedge ratio {hedge_error:.2e}, t {t_error:.2e}, p {p_error:.2e}, "
+          f"flag mismatches {flag_mismatches}")
+    assert max(hedge_error, t_error, p_error) < tolerance and flag_mismatches == 0, \
+        "Batch Engle-Granger disagrees with statsmodels"
+    return [record("engle_granger_per_pair", 2, n_bars, per_pair_time, pairs=n_candidates),
+            record("engle_granger_batch", 2, n_bars, batch_time, pairs=n_candidates)]
+
+
+# Close series where cointegrated_share of the markets come in groups sharing one random-walk factor
+def make_cointegrated_series(n_markets, n_bars, cointegrated_share=0.5, group_size=4, seed=0):
+    """
+        Each grouped market is its factor scaled by a random loading plus AR(1) noise, so pairs within a
+        group are cointegrated. The remaining markets are independent random walks.
+    """
+    rng = np.random.default_rng(seed)
+    n_linked = int(n_markets * cointegrated_share)
+    log_prices = np.cumsum(rng.normal(0, 0.01, (n_bars, n_markets)), axis=0)
+    factors = np.cumsum(rng.normal(0, 0.01, (n_bars, n_linked // group_size + 1)), axis=0)
+    noise = lfilter([1.0], [1.0, -0.8], rng.normal(0, 0.005, (n_bars, n_linked)), axis=0)
+    loadings = rng.uniform(0.5, 1.5, n_linked)
+    log_prices[:, :n_linked] = factors[:, np.arange(n_linked) // group_size] * loadings + noise
+    closes = 0.001 * np.exp(log_prices + rng.uniform(-2, 2, n_markets))
+    ts = SUITE_END_MS - np.arange(n_bars, 0, -1, dtype=np.int64) * HOUR_MS
+    return {f"M{i}/BTC": (ts, closes[:, i]) for i in range(n_markets)}
+
+
+def record(benchmark, n_markets, n_bars, seconds, **extra):
+    return {"benchmark": benchmark, "markets": n_markets, "bars": n_bars, "seconds": seconds, **extra}
+
+
+# Best of repeat runs with output silenced, and the last result - coroutine functions run on a fresh loop
+def timed_quietly(func, *args, repeat=3):
+    result = []
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            value = func(*args)
+            result[:] = [asyncio.run(value) if asyncio.iscoroutine(value) else value]
+    return timed(run, repeat=repeat), result[0]
+
+
+# Seconds per call over a sample of inputs
+def per_call(func, inputs):
+    started = time.perf_counter()
+    for args in inputs:
+        func(*args)
+    return (time.perf_counter() - started) / max(len(inputs), 1)
+
+
+def bench_suite_size(client, n_markets, n_bars, sample_pairs=50):
+    records = []
+    series_by_market = make_cointegrated_series(n_markets, n_bars)
+
+    # Matrix assembly through the candle store, first from an empty store, then topping up
+    delete_candles_after(RESOLUTION, -1)
+    cold, _ = timed_quietly(get_historical_price_matrix, client, n_bars, repeat=1)
+    warm, prices = timed_quietly(get_historical_price_matrix, client, n_bars)
+    prices = prices.to_frame()
+    records.append(record("historical_prices_cold", n_markets, n_bars, cold))
+    records.append(record("historical_prices_warm", n_markets, n_bars, warm))
+
+    seconds, pairs = timed_quietly(find_cointegrated_markets_from_all_markets, prices, repeat=1)
+    records.append(record("find_cointegrated", n_markets, n_bars, seconds, pairs=len(pairs)))
+
+    # Single-pair functions on a sample of pairs, half of them from the cointegrated groups
+    values = prices.to_numpy()
+    rng = np.random.default_rng(2)
+    first_columns, second_columns = rng.integers(0, n_markets, (2, sample_pairs))
+    grouped = np.arange(sample_pairs) % 2 == 0
+    second_columns[grouped] = first_columns[grouped] ^ 1
+    series = [(values[:, i], values[:, j]) for i, j in zip(first_columns, second_columns) if i != j]
+    spreads = [(first - second,) for first, second in series]
+    records.append(record("calculate_cointegration", n_markets, n_bars, per_call(calculate_cointegration, series),
+                          per="call"))
+    records.append(record("half_life_mean_reversion", n_markets, n_bars,
+                          per_call(half_life_mean_reversion, spreads), per="call"))
+    records.append(record("calculate_zscore", n_markets, n_bars, per_call(calculate_zscore, spreads), per="call"))
+    rolling = RollingZScore()
+    records.append(record("rolling_zscore_update", n_markets, n_bars,
+                          per_call(rolling.update, [(value,) for spread, in spreads for value in spread]), per="call"))
+
+    # Entry scan over the pairs found above - the mock holds no collateral, so nothing is traded
+    store_cointegrated_markets(pairs)
+    cold, _ = timed_quietly(open_positions, client, repeat=1)
+    warm, _ = timed_quietly(open_positions, client)
+    records.append(record("entry_scan_cold", n_markets, n_bars, cold, pairs=len(pairs)))
+    records.append(record("entry_scan_warm", n_markets, n_bars, warm, pairs=len(pairs)))
+    return records
+
+
+# Data and statistics hot paths on synthetic markets, served by the mock exchange from a scratch database
+def bench_suite(markets=SUITE_MARKETS, bars=SUITE_BARS):
+    print("Suite: seconds per stage, best of 3 unless cold")
+    records = []
+    migrations = os.path.abspath(MIGRATION_PATH)
+    cwd = os.getcwd()
+    set_clock(SimulatedClock(SUITE_END_MS / 1000, speed=1))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        db_path = os.path.join(tmp_dir, "benchmark.sqlite")
+        previous_db_path = use_database(db_path)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_migrations(db_path, migrations)
+            for n_bars in bars:
+                for n_markets in markets:
+                    candles = {market: [[t, c, c, c, c, 1.0] for t, c in zip(ts.tolist(), closes.tolist())]
+                               for market, (ts, closes) in make_cointegrated_series(n_markets, n_bars).items()}
+                    client = MockExchange(SimulatedClock(SUITE_END_MS / 1000, speed=1), candles, balance=0)
+                    # A new exchange id per size so the market cache reloads
+                    client.id = f"mock-{n_markets}x{n_bars}"
+                    size_records = bench_suite_size(client, n_markets, n_bars)
+                    for entry in size_records:
+                        print(f"{n_markets:>5} markets x {n_bars:>5} bars: {entry['benchmark']:<26} "
+                              f"{entry['seconds']:10.6f}s")
+                    records += size_records
+        finally:
+            close_connections()
+            use_database(previous_db_path)
+            os.chdir(cwd)
+            set_clock(None)
+    return records
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+BENCHMARKS = {
+    "price_matrix": lambda args: bench_price_matrix(),
+    "engle_granger": lambda args: bench_engle_granger(),
+    "suite": lambda args: bench_suite(args.markets, args.bars),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the data and statistics hot paths")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run from {', '.join(BENCHMARKS)}, all by default")
+    parser.add_argument("--markets", type=int, nargs="+", default=SUITE_MARKETS, help="suite market counts")
+    parser.add_argument("--bars", type=int, nargs="+", default=SUITE_BARS, help="suite bar counts")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are written to")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    results = []
+    for name in args.names or list(BENCHMARKS):
+        results += BENCHMARKS[name](args)
+    report = {"commit": git_commit(), "python": platform.python_version(), "numpy": np.__version__,
+              "cpus": os.cpu_count(), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+# constants reads exchange credentials on import, which the tests do not need
+os.environ.setdefault("BINANCE_API_KEY", "")
+os.environ.setdefault("BINANCE_API_SECRET", "")
+
+MIGRATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+# Fresh migrated database used by every call that is not given a path
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    import func_database
+    from basecommander import run_migrations
+
+    path = str(tmp_path / "test.sqlite")
+    run_migrations(path, MIGRATION_DIR)
+    monkeypatch.setattr(func_database, "_database_path", path)
+    yield path
+    func_database.close_connections()
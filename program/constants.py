@@ -6,21 +6,71 @@ EXCHANGE= "binance"
 API_KEY = config(f"{EXCHANGE.upper()}_API_KEY")
 API_SECRET = config(f"{EXCHANGE.upper()}_API_SECRET")
 
+# Mock Exchange - replay the stored candles through an in-process exchange on a clock running MOCK_CLOCK_SPEED
+# times real time, starting at MOCK_START_TIME (ms, None starts HISTORY_BARS bars into the store). Orders fill
+# MOCK_FILL_LATENCY_SECONDS of simulated time after they are sent, at the last close moved MOCK_SLIPPAGE against them.
+# Positions and candles are written to a copy of the database at MOCK_DATABASE_PATH
+USE_MOCK_EXCHANGE = False
+MOCK_CLOCK_SPEED = 3600
+MOCK_START_TIME = None
+MOCK_FILL_LATENCY_SECONDS = 0.5
+MOCK_SLIPPAGE = 0.0005
+MOCK_STARTING_BALANCE = 1000
+MOCK_DATABASE_PATH = "mock.sqlite"
+
 # Close all open positions and orders
 ABORT_ALL_POSITIONS = False
 
 # Find Cointegrated Pairs
 FIND_COINTEGRATED = True
 
+# Backtest the stored cointegrated pairs with the current thresholds
+RUN_BACKTEST = False
+
+# Walk-forward sweep of the strategy settings, results stored in sweep_result
+RUN_SWEEP = False
+
 # Manage Exits
 MANAGE_EXITS = False
 
 # Place Trades
 PLACE_TRADES = False
 
+# Streaming - keep prices for the cointegrated markets current from kline streams instead of polling
+USE_STREAMING = False
+
+# Signal Scheduling - seconds after a candle close to evaluate, and the move in a pair's rolling ZScore
+# that wakes evaluation early when streaming
+CANDLE_CLOSE_DELAY_SECONDS = 2
+SPREAD_WAKE_ZSCORE = 0.25
+
 # Resolution - ccxt timeframe
 RESOLUTION = "1h"
 
+# Candle History - bars in the statistics window and bars per fetch_ohlcv page
+HISTORY_BARS = 400
+PAGE_LIMIT = 1000
+
+
+# Cointegration Scan - worker processes (None uses every core) and pairs per shard
+COINTEGRATION_WORKERS = None
+COINTEGRATION_CHUNK_SIZE = 2000
+
+# Incremental Cointegration - upsert results, re-testing a pair after this many new bars or hours
+COINTEGRATION_INCREMENTAL = False
+COINTEGRATION_RETEST_BARS = 24
+COINTEGRATION_MAX_AGE_HOURS = 24
+COINTEGRATION_MAX_RETESTS = None  # Cap on pairs tested per run, oldest first
+
+# Pair Pre-screen - cheap filters before the cointegration test, None disables a bound. Off by default, since any
+# bound can drop pairs the Engle-Granger test would pass (cointegrated pairs can have low correlation)
+PRESCREEN_ENABLED = False
+PRESCREEN_ON_RETURNS = False
+PRESCREEN_MIN_CORRELATION = 0.5
+PRESCREEN_TOP_K = None
+PRESCREEN_VARIANCE_RATIO = None  # (low, high) e.g. (0.0, 1.0)
+PRESCREEN_VARIANCE_RATIO_LAG = 10
+PRESCREEN_MAX_HALF_LIFE = None
 
 # Stats Window
 WINDOW = 21
@@ -36,5 +86,47 @@ CLOSE_AT_ZSCORE_CROSS = True
 
 QUOTE_CURRENCY = "BTC"
 
+# Market Metadata Cache - file holding the active markets' trading rules and seconds before reloading them
+MARKET_CACHE_PATH = "markets_cache.json"
+MARKET_CACHE_TTL_SECONDS = 3600
+
+# Parameter Sweep - values tried per setting, combinations sampled (None runs the full grid),
+# walk-forward train and test bars, bars of history downloaded and worker processes (None uses every core)
+SWEEP_WINDOWS = [14, 21, 30]
+SWEEP_ZSCORE_THRESHOLDS = [1.0, 1.5, 2.0]
+SWEEP_MAX_HALF_LIVES = [12, 24, 48]
+SWEEP_P_VALUE_CUTOFFS = [0.01, 0.05, 0.1]
+SWEEP_SAMPLES = None
+SWEEP_TRAIN_BARS = 400
+SWEEP_TEST_BARS = 100
+SWEEP_HISTORY_BARS = 2000
+SWEEP_WORKERS = None
+
+# Candle Downloads - requests in flight, retries on network errors and request weight per fetch_ohlcv
+MAX_CONCURRENT_REQUESTS = 10
+REQUEST_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.5
+OHLCV_REQUEST_COST = 1
+
+# Order Execution - pairs opened at once, and whether both legs are submitted together instead of in turn
+MAX_CONCURRENT_AGENTS = 4
+SUBMIT_LEGS_TOGETHER = False
+
+# Order Fill Confirmation - seconds before the first status poll, backoff factor and cap between polls,
+# and the overall wait before an unfilled order is cancelled
+ORDER_POLL_INITIAL_SECONDS = 1
+ORDER_POLL_BACKOFF = 2
+ORDER_POLL_MAX_SECONDS = 5
+ORDER_FILL_TIMEOUT_SECONDS = 17
+
+# Database Tuning - bytes of the file memory-mapped for reads and milliseconds a writer waits on a locked database
+DATABASE_MMAP_SIZE = 256 * 1024 * 1024
+DATABASE_BUSY_TIMEOUT_MS = 5000
+
+# Metrics - time stages, exchange requests and database writes and count retries and pairs evaluated, written in the
+# Prometheus text format to METRICS_PATH (e.g. for the node_exporter textfile collector). Off costs next to nothing
+METRICS_ENABLED = False
+METRICS_PATH = "metrics.prom"
+
 DATABASE_PATH = "db.sqlite"
 MIGRATION_PATH = "migrations"
\ No newline at end of file
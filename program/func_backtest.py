@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+from constants import WINDOW, ZSCORE_THRESH, MAX_HALF_LIFE, CLOSE_AT_ZSCORE_CROSS, USD_PER_TRADE
+from func_cointegration import rolling_zscores
+from func_database import get_cointegrated_markets
+from func_public import get_historical_price_matrix
+
+
+# Outcome of one backtest run
+class BacktestResult:
+    """
+        trades: one row per round trip with pair index, entry and exit bar, entry ZScore, pnl and
+        whether it was still open at the last bar (then marked to that bar's prices).
+        pairs: per-pair trade count, wins and pnl. equity: portfolio pnl realised by each bar.
+    """
+
+    def __init__(self, trades, pairs, equity):
+        self.trades = trades
+        self.pairs = pairs
+        self.equity = equity
+
+    def summary(self):
+        closed = self.trades[~self.trades["open"]]
+        drawdown = (self.equity.cummax() - self.equity).max() if len(self.equity) else 0.0
+        return {
+            "pairs": len(self.pairs),
+            "trades": len(self.trades),
+            "open_trades": int(self.trades["open"].sum()),
+            "win_rate": float((closed["pnl"] > 0).mean()) if len(closed) else float("nan"),
+            "pnl": float(self.trades["pnl"].sum()),
+            "max_drawdown": float(drawdown),
+        }
+
+
+# Index of the first bar at or after each bar where the condition holds, n_bars where it never does
+def _next_true(condition):
+    n_bars = condition.shape[0]
+    bars = np.where(condition, np.arange(n_bars, dtype=np.int32)[:, None], np.int32(n_bars))
+    following = np.minimum.accumulate(bars[::-1], axis=0)[::-1]
+    return np.vstack([following, np.full((1, condition.shape[1]), n_bars, dtype=np.int32)])
+
+
+def backtest_pairs(prices, first_indices, second_indices, hedge_ratios, half_lives=None, window=WINDOW,
+                   zscore_thresh=ZSCORE_THRESH, max_half_life=MAX_HALF_LIFE,
+                   close_at_zscore_cross=CLOSE_AT_ZSCORE_CROSS, usd_per_trade=USD_PER_TRADE, zscores=None):
+    """
+        Replays the open_positions entry and manage_trade_exits exit rules over a price array
+        (bars x markets) for every pair at once. Each pair trades independently: a pair opens at the
+        close of the first bar with |z| >= zscore_thresh, buying the first market when z < 0, and
+        closes at the first later bar whose z has crossed zero and reached at least |entry z|.
+        The Python loop runs once per round trip across all pairs, never per bar.
+        zscores may be passed in when the same spreads are backtested with several rule settings.
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    first_indices = np.asarray(first_indices)
+    second_indices = np.asarray(second_indices)
+    hedge_ratios = np.asarray(hedge_ratios, dtype=np.float64)
+    n_bars, n_pairs = prices.shape[0], len(first_indices)
+
+    if zscores is None:
+        zscores = rolling_zscores(prices[:, first_indices] - prices[:, second_indices] * hedge_ratios, window)
+    eligible = np.ones(n_pairs, dtype=bool)
+    if half_lives is not None and max_half_life is not None:
+        half_lives = np.asarray(half_lives, dtype=np.float64)
+        eligible = (half_lives > 0) & (half_lives <= max_half_life)
+    next_entry = _next_true(np.abs(np.nan_to_num(zscores)) >= zscore_thresh)
+
+    trade_pairs, entries, exits = [], [], []
+    pointer = np.full(n_pairs, window - 1)
+    active = np.flatnonzero(eligible)
+    while len(active):
+        entry = next_entry[np.minimum(pointer[active], n_bars), active]
+        opened = entry < n_bars
+        active, entry = active[opened], entry[opened]
+        if not len(active):
+            break
+
+        exit_bar = np.full(len(active), n_bars - 1)
+        start = entry.min() + 1
+        if close_at_zscore_cross and start < n_bars:
+            entry_z = zscores[entry, active]
+            later = zscores[start:, active]
+            crossed = (later * np.sign(entry_z) < 0) & (np.abs(later) >= np.abs(entry_z))
+            crossed &= np.arange(start, n_bars)[:, None] > entry
+            found = crossed.any(axis=0)
+            exit_bar[found] = crossed.argmax(axis=0)[found] + start
+
+        trade_pairs.append(active)
+        entries.append(entry)
+        exits.append(exit_bar)
+        pointer[active] = exit_bar + 1
+        active = active[exit_bar < n_bars - 1]
+
+    trade_pairs = np.concatenate(trade_pairs) if trade_pairs else np.array([], dtype=np.int64)
+    entries = np.concatenate(entries) if entries else np.array([], dtype=np.int64)
+    exits = np.concatenate(exits) if exits else np.array([], dtype=np.int64)
+
+    # PnL in quote currency of holding usd_per_trade of each leg from entry to exit
+    entry_z = zscores[entries, trade_pairs]
+    direction = np.where(entry_z < 0, 1.0, -1.0)
+    first_columns, second_columns = first_indices[trade_pairs], second_indices[trade_pairs]
+    first_entry, second_entry = prices[entries, first_columns], prices[entries, second_columns]
+    first_return = prices[exits, first_columns] / first_entry - 1
+    second_return = prices[exits, second_columns] / second_entry - 1
+    pnl = direction * usd_per_trade * (first_return - second_return)
+    still_open = exits == n_bars - 1
+    if close_at_zscore_cross and len(exits):
+        closed_at_end = np.abs(zscores[exits, trade_pairs]) >= np.abs(entry_z)
+        closed_at_end &= zscores[exits, trade_pairs] * np.sign(entry_z) < 0
+        still_open &= ~closed_at_end
+
+    trades = pd.DataFrame({"pair": trade_pairs, "entry_bar": entries, "exit_bar": exits, "entry_zscore": entry_z,
+                           "pnl": pnl, "open": still_open}).sort_values(["pair", "entry_bar"], ignore_index=True)
+    pairs = pd.DataFrame({
+        "trades": np.bincount(trade_pairs, minlength=n_pairs),
+        "wins": np.bincount(trade_pairs, weights=pnl > 0, minlength=n_pairs).astype(np.int64),
+        "pnl": np.bincount(trade_pairs, weights=pnl, minlength=n_pairs),
+    })
+    equity = pd.Series(np.cumsum(np.bincount(exits, weights=pnl, minlength=n_bars)), name="pnl")
+    return BacktestResult(trades, pairs, equity)
+
+
+# Backtest every stored cointegrated pair over a price matrix
+def backtest_price_matrix(prices, pairs, **rules):
+    pairs = pairs[pairs["first_market"].isin(prices.column) & pairs["second_market"].isin(prices.column)]
+    pairs = pairs.reset_index(drop=True)
+    result = backtest_pairs(
+        prices.values,
+        pairs["first_market"].map(prices.column).to_numpy(),
+        pairs["second_market"].map(prices.column).to_numpy(),
+        pairs["hedge_ratio"].to_numpy(),
+        pairs["half_life"].to_numpy(),
+        **rules,
+    )
+    result.pairs = pd.concat([pairs[["first_market", "second_market"]], result.pairs], axis=1)
+    result.equity.index = pd.Index(prices.timestamps, name="datetime")
+    return result
+
+
+async def backtest_stored_pairs(exchange, **rules):
+    prices = await get_historical_price_matrix(exchange)
+    return backtest_price_matrix(prices, get_cointegrated_markets(), **rules)
@@ -1,7 +1,8 @@
-from func_private import place_market_order, check_order_status, cancel_order
+from func_private import place_market_order, wait_for_order_status, cancel_order
 from datetime import datetime
 from func_messaging import send_message
-import time
+from func_utils import as_awaitable
+import asyncio
 
 from pprint import pprint
 
@@ -29,6 +30,7 @@ class BotAgent:
     z_score,
     half_life,
     hedge_ratio,
+    accept_failsafe_quote_price=None,
   ):
 
     # Initialize class variables
@@ -42,6 +44,7 @@ class BotAgent:
     self.quote_size = quote_size
     self.quote_price = quote_price
     self.accept_failsafe_base_price = accept_failsafe_base_price
+    self.accept_failsafe_quote_price = accept_failsafe_quote_price
     self.z_score = z_score
     self.half_life = half_life
     self.hedge_ratio = hedge_ratio
@@ -67,13 +70,10 @@ class BotAgent:
     }
 
   # Check order status by id
-  async def check_order_status_by_id(self, order_id):
+  async def check_order_status_by_id(self, order_id, market):
 
-    # Allow time to process
-    time.sleep(2)
-
-    # Check order status
-    order_status =  await check_order_status(self.client, order_id)
+    # Poll until filled, cancelled or the fill timeout passes - awaits so other pairs keep running
+    order_status = await wait_for_order_status(self.client, order_id, market)
 
     # Guard: If order cancelled move onto next Pair
     if order_status == "CANCELED":
@@ -81,23 +81,12 @@ class BotAgent:
       self.order_dict["pair_status"] = "FAILED"
       return "failed"
 
-    # Guard: If order not filled wait until order expiration
-    if order_status != "FAILED":
-      time.sleep(15)
-      order_status = await check_order_status(self.client, order_id)
-
-      # Guard: If order cancelled move onto next Pair
-      if order_status == "CANCELED":
-        print(f"{self.market_1} vs {self.market_2} - Order cancelled...")
-        self.order_dict["pair_status"] = "FAILED"
-        return "failed"
-
-      # Guard: If not filled, cancel order
-      if order_status != "FILLED":
-        await cancel_order(self.client, order_id)
-        self.order_dict["pair_status"] = "ERROR"
-        print(f"{self.market_1} vs {self.market_2} - Order error. Cancellation request sent, please check open orders..")
-        return "error"
+    # Guard: If still pending at the timeout, cancel order
+    if order_status not in ("FILLED", "FAILED"):
+      await cancel_order(self.client, order_id, market)
+      self.order_dict["pair_status"] = "ERROR"
+      print(f"{self.market_1} vs {self.market_2} - Order error. Cancellation request sent, please check open orders..")
+      return "error"
 
     # Return live
     return "live"
@@ -135,7 +124,7 @@ class BotAgent:
     # Ensure order is live before processing
     print("Checking first order status...")
     print(self.order_dict["order_id_m1"])
-    order_status_m1 = await self.check_order_status_by_id(self.order_dict["order_id_m1"])
+    order_status_m1 = await self.check_order_status_by_id(self.order_dict["order_id_m1"], self.market_1)
     print(order_status_m1)
 
     # Guard: Aborder if order failed
@@ -173,7 +162,7 @@ class BotAgent:
 
     # Ensure order is live before processing
     print("Checking second order status...")
-    order_status_m2 = await self.check_order_status_by_id(self.order_dict["order_id_m2"])
+    order_status_m2 = await self.check_order_status_by_id(self.order_dict["order_id_m2"], self.market_2)
 
     # Guard: Aborder if order failed
     if order_status_m2 != "live":
@@ -181,46 +170,111 @@ class BotAgent:
       self.order_dict["comments"] = f"{self.market_1} failed to fill"
 
       # Close order 1:
-      try:
-        (close_order, order_id) =  await place_market_order(
-          self.client,
-          market=self.market_1,
-          side=self.quote_side,
-          size=self.base_size,
-          price=self.accept_failsafe_base_price,
-          reduce_only=True
-        )
-
-        # Ensure order is live before proceeding
-        time.sleep(2)
-        order_status_close_order = await check_order_status(self.client, order_id)
-        if order_status_close_order != "FILLED":
-          print("ABORT PROGRAM")
-          print("Unexpected Error")
-          print(order_status_close_order)
-
-          # Send Message
-          send_message("Failed to execute. Code red. Error code: 100")
-
-          # ABORT
-          exit(1)
-      except Exception as e:
-        self.order_dict["pair_status"] = "ERROR"
-        self.order_dict["comments"] = f"Close Market 1 {self.market_1}: , {e}"
+      await self.unwind_leg(self.market_1, self.quote_side, self.base_size, self.accept_failsafe_base_price)
+      return self.order_dict
+
+    # Return success result
+    else:
+      print("")
+      print("SUCCESS: LIVE PAIR")
+      print("")
+      self.order_dict["pair_status"] = "LIVE"
+      return self.order_dict
+
+  # Close a filled leg after the other leg failed
+  async def unwind_leg(self, market, side, size, price):
+    order_status_close_order = None
+    try:
+      (close_order, order_id) = await place_market_order(
+        self.client,
+        market=market,
+        side=side,
+        size=size,
+        price=price,
+        reduce_only=True
+      )
+
+      # Ensure order is live before proceeding
+      order_status_close_order = await wait_for_order_status(self.client, order_id, market)
+      if order_status_close_order != "FILLED":
         print("ABORT PROGRAM")
         print("Unexpected Error")
         print(order_status_close_order)
 
         # Send Message
-        send_message("Failed to execute. Code red. Error code: 101")
+        send_message("Failed to execute. Code red. Error code: 100")
 
         # ABORT
         exit(1)
+    except Exception as e:
+      self.order_dict["pair_status"] = "ERROR"
+      self.order_dict["comments"] = f"Close {market}: , {e}"
+      print("ABORT PROGRAM")
+      print("Unexpected Error")
+      print(order_status_close_order)
+
+      # Send Message
+      send_message("Failed to execute. Code red. Error code: 101")
+
+      # ABORT
+      exit(1)
+
+  # Open trades - both legs submitted at once
+  async def open_trades_together(self):
+
+    """
+      Sends both legs concurrently and waits for both fills together, so the pair is exposed
+      to one leg for the time of a single order round trip rather than a full fill wait.
+      If exactly one leg fills it is closed again at its failsafe price.
+    """
+
+    # Print status
+    print("---")
+    print(f"{self.market_1} and {self.market_2}: Placing both orders...")
+    print(f"Side: {self.base_side}, Size: {self.base_size}, Price: {self.base_price}")
+    print(f"Side: {self.quote_side}, Size: {self.quote_size}, Price: {self.quote_price}")
+    print("---")
+
+    # Place both orders
+    base_result, quote_result = await asyncio.gather(
+      place_market_order(self.client, market=self.market_1, side=self.base_side, size=self.base_size,
+                         price=self.base_price, reduce_only=False),
+      place_market_order(self.client, market=self.market_2, side=self.quote_side, size=self.quote_size,
+                         price=self.quote_price, reduce_only=False),
+      return_exceptions=True,
+    )
+    order_time = datetime.now().isoformat()
+    base_sent = not isinstance(base_result, BaseException)
+    quote_sent = not isinstance(quote_result, BaseException)
+    if base_sent:
+      self.order_dict["order_id_m1"] = base_result[1]
+      self.order_dict["order_time_m1"] = order_time
+    if quote_sent:
+      self.order_dict["order_id_m2"] = quote_result[1]
+      self.order_dict["order_time_m2"] = order_time
+
+    # Ensure both orders are live
+    print("Checking order statuses...")
+    order_status_m1, order_status_m2 = await asyncio.gather(
+      self.check_order_status_by_id(self.order_dict["order_id_m1"], self.market_1) if base_sent else as_awaitable(base_result),
+      self.check_order_status_by_id(self.order_dict["order_id_m2"], self.market_2) if quote_sent else as_awaitable(quote_result),
+    )
+    base_live = order_status_m1 == "live"
+    quote_live = order_status_m2 == "live"
 
     # Return success result
-    else:
+    if base_live and quote_live:
       print("")
       print("SUCCESS: LIVE PAIR")
       print("")
       self.order_dict["pair_status"] = "LIVE"
       return self.order_dict
+
+    # Guard: Unwind whichever leg filled on its own
+    self.order_dict["pair_status"] = "ERROR"
+    self.order_dict["comments"] = f"Market 1 {self.market_1}: {order_status_m1}, Market 2 {self.market_2}: {order_status_m2}"
+    if base_live:
+      await self.unwind_leg(self.market_1, self.quote_side, self.base_size, self.accept_failsafe_base_price)
+    if quote_live:
+      await self.unwind_leg(self.market_2, self.base_side, self.quote_size, self.accept_failsafe_quote_price)
+    return self.order_dict
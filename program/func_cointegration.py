@@ -1,10 +1,17 @@
 import numpy as np
 import pandas as pd
 import statsmodels.api as sm
-from scipy.stats import linregress
+from scipy.stats import norm
+from statsmodels.tsa.adfvalues import mackinnoncrit, mackinnonp
 from statsmodels.tsa.stattools import coint
 
-from constants import MAX_HALF_LIFE, WINDOW
+# MacKinnon (1994) coefficient tables - private to statsmodels, so the public scalar mackinnonp is used if they move
+try:
+    from statsmodels.tsa.adfvalues import _tau_maxs, _tau_mins, _tau_stars, _tau_smallps, _tau_largeps
+except ImportError:
+    _tau_maxs = None
+
+from constants import WINDOW
 
 
 class SmartError(Exception):
@@ -14,15 +21,35 @@ class SmartError(Exception):
 def half_life_mean_reversion(series):
     if len(series) <= 1:
         raise SmartError("Series length must be greater than 1.")
-    difference = np.diff(series)
-    lagged_series = series[:-1]
-    slope, _, _, _, _ = linregress(lagged_series, difference)
-    if np.abs(slope) < np.finfo(np.float64).eps:
+    half_life = half_life_mean_reversion_batch(series)[0]
+    if np.isnan(half_life):
         raise SmartError("Cannot calculate half life. Slope value is too close to zero.")
-    half_life = -np.log(2) / slope
     return half_life
 
 
+# Half life of every spread column in one pass
+def half_life_mean_reversion_batch(spreads):
+    """
+        spreads: (n,) or (n, k) array, one spread per column
+        Slope of each column's change on its lagged level in closed form, as linregress would give.
+        Returns k half lives, NaN where the series is too short or the slope is degenerate.
+    """
+    spreads = np.asarray(spreads, dtype=np.float64)
+    if spreads.ndim == 1:
+        spreads = spreads[:, None]
+    if spreads.shape[0] <= 1:
+        return np.full(spreads.shape[1], np.nan)
+
+    lagged = spreads[:-1] - spreads[:-1].mean(axis=0)
+    differences = np.diff(spreads, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slopes = np.einsum("ij,ij->j", lagged, differences) / np.einsum("ij,ij->j", lagged, lagged)
+        half_lives = -np.log(2) / slopes
+    degenerate = ~np.isfinite(slopes) | (np.abs(slopes) < np.finfo(np.float64).eps)
+    half_lives[degenerate] = np.nan
+    return half_lives
+
+
 # Calculate ZScore
 def calculate_zscore(spread):
     spread_series = pd.Series(spread)
@@ -33,6 +60,113 @@ def calculate_zscore(spread):
     return zscore
 
 
+# ZScore of every spread column at every bar
+def rolling_zscores(spreads, window=WINDOW):
+    """
+        Same values as calculate_zscore on each column, from cumulative sums instead of a rolling loop.
+        Columns are centred first so the sums of squares do not lose precision.
+    """
+    spreads = np.asarray(spreads, dtype=np.float64)
+    if spreads.ndim == 1:
+        spreads = spreads[:, None]
+    zscores = np.full(spreads.shape, np.nan)
+    if spreads.shape[0] < window:
+        return zscores
+
+    centred = spreads - spreads.mean(axis=0)
+    sums = np.cumsum(np.vstack([np.zeros((1, centred.shape[1])), centred]), axis=0)
+    squares = np.cumsum(np.vstack([np.zeros((1, centred.shape[1])), centred * centred]), axis=0)
+    window_sums = sums[window:] - sums[:-window]
+    window_squares = squares[window:] - squares[:-window]
+    means = window_sums / window
+    variances = np.maximum(window_squares - window_sums * means, 0) / (window - 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        zscores[window - 1:] = (centred[window - 1:] - means) / np.sqrt(variances)
+    return zscores
+
+
+# Latest ZScore of every spread column, from the last window rows only
+def latest_zscores(spreads, window=WINDOW):
+    """
+        Same value as calculate_zscore(spread).values[-1] for each column, without rolling the whole series.
+    """
+    spreads = np.asarray(spreads, dtype=np.float64)
+    if spreads.ndim == 1:
+        spreads = spreads[:, None]
+    if spreads.shape[0] < window:
+        return np.full(spreads.shape[1], np.nan)
+    recent = spreads[-window:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (recent[-1] - recent.mean(axis=0)) / recent.std(axis=0, ddof=1)
+
+
+# Latest ZScore of many pairs straight from a price matrix
+def latest_pair_zscores(prices, first_indices, second_indices, hedge_ratios, window=WINDOW):
+    recent = np.asarray(prices[-window:], dtype=np.float64)
+    spreads = recent[:, first_indices] - recent[:, second_indices] * np.asarray(hedge_ratios, dtype=np.float64)
+    return latest_zscores(spreads, window)
+
+
+# Rolling ZScore state for one pair, updated bar by bar in constant time
+class RollingZScore:
+    """
+        Ring buffer of the last window spreads with a running sum and sum of squares.
+        Sums are rebuilt from the buffer once per window of updates so rounding drift cannot build up.
+    """
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.buffer = np.zeros(window)
+        self.count = 0
+        self.position = 0
+        self.updates = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+
+    @classmethod
+    def from_spread(cls, spread, window=WINDOW):
+        rolling = cls(window)
+        for value in np.asarray(spread, dtype=np.float64)[-window:]:
+            rolling.update(value)
+        return rolling
+
+    def update(self, spread):
+        if self.count == self.window:
+            oldest = self.buffer[self.position]
+            self.total -= oldest
+            self.total_squares -= oldest * oldest
+        else:
+            self.count += 1
+        self.buffer[self.position] = spread
+        self.total += spread
+        self.total_squares += spread * spread
+        self.position = (self.position + 1) % self.window
+        self.updates += 1
+        if self.updates % self.window == 0:
+            self.total = float(self.buffer[:self.count].sum())
+            self.total_squares = float(np.dot(self.buffer[:self.count], self.buffer[:self.count]))
+        return self.zscore
+
+    def replace_last(self, spread):
+        # Revise the newest value, e.g. while the current candle is still forming
+        last = (self.position - 1) % self.window
+        previous = self.buffer[last]
+        self.buffer[last] = spread
+        self.total += spread - previous
+        self.total_squares += spread * spread - previous * previous
+        return self.zscore
+
+    @property
+    def zscore(self):
+        if self.count < self.window:
+            return np.nan
+        mean = self.total / self.window
+        variance = (self.total_squares - self.window * mean * mean) / (self.window - 1)
+        if variance <= 0:
+            return np.nan
+        return (self.buffer[(self.position - 1) % self.window] - mean) / np.sqrt(variance)
+
+
 # Calculate Cointegration
 def calculate_cointegration(series_1, series_2):
     series_1 = np.array(series_1).astype(np.float64)
@@ -52,23 +186,103 @@ def calculate_cointegration(series_1, series_2):
     return cointegration_flag, hedge_ratio, half_life
 
 
-# Store Cointegration Results
-def find_cointegrated_markets_from_all_markets(df_market_prices):
-    # Initialize
-    markets = df_market_prices.columns.to_list()
-    criteria_met_pairs = []
-
-    for index, first_market in enumerate(markets[:-1]):
-        series_1 = df_market_prices[first_market].values.astype(np.float64).tolist()
-        for second_market in markets[index + 1:]:
-            series_2 = df_market_prices[second_market].values.astype(np.float64).tolist()
-            cointegration_flag, hedge_ratio, half_life = calculate_cointegration(series_1, series_2)
-            if cointegration_flag == 1 and MAX_HALF_LIFE >= half_life > 0:
-                criteria_met_pairs.append({
-                    "first_market": first_market,
-                    "second_market": second_market,
-                    "hedge_ratio": hedge_ratio,
-                    "half_life": half_life,
-                })
-    df_criteria_met = pd.DataFrame(criteria_met_pairs)
-    return df_criteria_met
+# MacKinnon (1994) approximate p-values for an array of Engle-Granger t statistics
+def mackinnon_pvalues(t_stats, n_vars=2):
+    t_stats = np.asarray(t_stats, dtype=np.float64)
+    if _tau_maxs is None:
+        return np.vectorize(lambda t_stat: mackinnonp(t_stat, regression="c", N=n_vars), otypes=[np.float64])(t_stats)
+    small_p = np.polyval(_tau_smallps["c"][n_vars - 1][::-1], t_stats)
+    large_p = np.polyval(_tau_largeps["c"][n_vars - 1][::-1], t_stats)
+    p_values = norm.cdf(np.where(t_stats <= _tau_stars["c"][n_vars - 1], small_p, large_p))
+    p_values = np.where(t_stats > _tau_maxs["c"][n_vars - 1], 1.0, p_values)
+    return np.where(t_stats < _tau_mins["c"][n_vars - 1], 0.0, p_values)
+
+
+# ADF t statistics (no constant, AIC lag search) for every residual column at once
+def adf_t_stats(residuals, max_lag=None, block_size=256):
+    """
+        Matches statsmodels adfuller(x, autolag="aic", regression="n") column by column.
+        The lag search fits every lag on one common sample, so a single batched QR of the
+        largest design gives the residual sum of squares of all nested models.
+    """
+    n_obs, n_cols = residuals.shape
+    if max_lag is None:
+        max_lag = min(n_obs // 2 - 1, int(np.ceil(12.0 * np.power(n_obs / 100.0, 1 / 4.0))))
+    diffs = np.diff(residuals, axis=0)
+    t_stats = np.empty(n_cols)
+
+    def design_matrix(cols, lags):
+        rows = n_obs - 1 - lags
+        design = np.empty((len(cols), rows, lags + 1))
+        design[:, :, 0] = residuals[lags:n_obs - 1, cols].T
+        for lag in range(1, lags + 1):
+            design[:, :, lag] = diffs[lags - lag:n_obs - 1 - lag, cols].T
+        return design, np.ascontiguousarray(diffs[lags:, cols].T)
+
+    for start in range(0, n_cols, block_size):
+        cols = np.arange(start, min(start + block_size, n_cols))
+
+        # Lag search - AIC on the common sample, smallest lag wins ties
+        design, target = design_matrix(cols, max_lag)
+        q, _ = np.linalg.qr(design)
+        projected = np.einsum("kmi,km->ki", q, target)
+        ssr = np.einsum("km,km->k", target, target)[:, None] - np.cumsum(projected ** 2, axis=1)
+        n_rows = target.shape[1]
+        aic = n_rows * np.log(ssr / n_rows) + 2 * np.arange(1, max_lag + 2)
+        best_lags = np.argmin(aic, axis=1)
+
+        # Refit each group of columns sharing a best lag on its full sample
+        for lags in np.unique(best_lags):
+            group = cols[best_lags == lags]
+            design, target = design_matrix(group, lags)
+            q, r = np.linalg.qr(design)
+            projected = np.einsum("kmi,km->ki", q, target)
+            params = np.linalg.solve(r, projected[:, :, None])[:, :, 0]
+            ssr = np.einsum("km,km->k", target, target) - np.einsum("ki,ki->k", projected, projected)
+            sigma2 = ssr / (target.shape[1] - (lags + 1))
+            r_inv = np.linalg.inv(r)
+            t_stats[group] = params[:, 0] / np.sqrt(sigma2 * np.einsum("ki,ki->k", r_inv[:, 0, :], r_inv[:, 0, :]))
+    return t_stats
+
+
+# Calculate Cointegration of one series against a block of candidates
+def calculate_cointegration_batch(series_1, block, p_value_cutoff=0.05):
+    """
+        series_1: (n,) base series, regressed on each column of block (n, k) as in calculate_cointegration
+        Returns arrays of cointegration flags, hedge ratios, intercepts, t statistics and p-values,
+        with the flags set by cointegration_flags.
+    """
+    series_1 = np.asarray(series_1, dtype=np.float64)
+    block = np.asarray(block, dtype=np.float64)
+    n_obs = len(series_1)
+
+    # Closed-form least squares for every candidate
+    centred_1 = series_1 - series_1.mean()
+    block_means = block.mean(axis=0)
+    centred_block = block - block_means
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hedge_ratios = centred_block.T @ centred_1 / np.einsum("ij,ij->j", centred_block, centred_block)
+        intercepts = series_1.mean() - hedge_ratios * block_means
+        residuals = series_1[:, None] - block * hedge_ratios - intercepts
+        r_squared = 1 - np.einsum("ij,ij->j", residuals, residuals) / (centred_1 @ centred_1)
+
+    # Near-perfect collinearity is treated as cointegrated, as statsmodels does
+    valid = np.isfinite(hedge_ratios) & (r_squared < 1 - 100 * np.sqrt(np.finfo(np.float64).eps))
+    t_stats = np.where(np.isfinite(hedge_ratios), -np.inf, np.nan)
+    if valid.any():
+        t_stats[valid] = adf_t_stats(residuals[:, valid])
+
+    p_values = np.where(np.isnan(t_stats), np.nan, mackinnon_pvalues(np.nan_to_num(t_stats, nan=0.0)))
+    flags = cointegration_flags(t_stats, p_values, n_obs, p_value_cutoff)
+    return flags, hedge_ratios, intercepts, t_stats, p_values
+
+
+# Cointegration decision for Engle-Granger results on n_obs bars
+def cointegration_flags(t_stats, p_values, n_obs, p_value_cutoff=0.05):
+    """
+        A pair is flagged when its p-value is below p_value_cutoff. Up to 0.05 the t statistic must
+        also clear the 5% critical value, as calculate_cointegration requires.
+    """
+    critical_value = mackinnoncrit(N=2, regression="c", nobs=n_obs - 1)
+    t_limit = critical_value[1] if p_value_cutoff <= 0.05 else np.inf
+    return ((p_values < p_value_cutoff) & (t_stats < t_limit)).astype(int)
@@ -1,6 +1,9 @@
 import ccxt.async_support as ccxt
+import ccxt.pro as ccxtpro
 
-from constants import EXCHANGE, API_KEY, API_SECRET, IS_TESTING
+from constants import EXCHANGE, API_KEY, API_SECRET, IS_TESTING, USE_MOCK_EXCHANGE
+from func_metrics import instrument_client
+from func_mock_exchange import create_mock_exchange, get_mock_exchange
 
 
 # Client Class
@@ -14,6 +17,10 @@ class Client:
 
 # Connect to configured exchange
 async def connect_exchange():
+  # Replay stored candles in process instead
+  if USE_MOCK_EXCHANGE:
+    return instrument_client(create_mock_exchange())
+
   # Create ccxt client
   ccxt_client = getattr(ccxt, EXCHANGE)({
     'apiKey': API_KEY,
@@ -23,7 +30,21 @@ async def connect_exchange():
   # Determine market data endpoint
   ccxt_client.options["warnOnFetchOpenOrdersWithoutSymbol"] = False
   ccxt_client.set_sandbox_mode(IS_TESTING)
-  return ccxt_client
+  return instrument_client(ccxt_client)
+
+# Connect to configured exchange websocket streams
+async def connect_stream_exchange():
+  # The mock exchange streams its own candles
+  if USE_MOCK_EXCHANGE:
+    return get_mock_exchange()
+
+  stream_client = getattr(ccxtpro, EXCHANGE)({
+    'apiKey': API_KEY,
+    'secret': API_SECRET,
+    'enableRateLimit': True,
+  })
+  stream_client.set_sandbox_mode(IS_TESTING)
+  return stream_client
 
 async def close_client(client):
   await client.close()
@@ -1,15 +1,80 @@
+import os
 import sqlite3
+import threading
 from datetime import datetime, timezone
 
-from constants import DATABASE_PATH
+from constants import DATABASE_PATH, DATABASE_MMAP_SIZE, DATABASE_BUSY_TIMEOUT_MS
+from func_metrics import timed
 import pandas as pd
 
+# One connection per thread and database file, reused across calls
+_connections = threading.local()
 
-def _connect_to_database():
-    # Connect to the SQLite database
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    return conn, cursor
+# Database used when no path is given, switched to a copy while simulating
+_database_path = DATABASE_PATH
+
+
+def _open_connection(db_path):
+    conn = sqlite3.connect(db_path, timeout=DATABASE_BUSY_TIMEOUT_MS / 1000, cached_statements=256)
+    # WAL lets readers run alongside the writer, NORMAL sync is durable in WAL mode apart from power loss
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA mmap_size = {int(DATABASE_MMAP_SIZE)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def _connect_to_database(db_path=None):
+    """
+    Returns this thread's connection to the database and a fresh cursor. Connections are created
+    on first use, and again after a fork, since a SQLite handle must not cross processes.
+    Callers hand the connection back with _release instead of closing it.
+    """
+    db_path = db_path or _database_path
+    if getattr(_connections, "pid", None) != os.getpid():
+        _connections.pid = os.getpid()
+        _connections.by_path = {}
+    conn = _connections.by_path.get(db_path)
+    if conn is None:
+        conn = _connections.by_path[db_path] = _open_connection(db_path)
+    return conn, conn.cursor()
+
+
+def _release(conn):
+    # Anything left uncommitted belongs to a call that failed part way, so it must not leak into the next one
+    if conn.in_transaction:
+        conn.rollback()
+
+
+def close_connections():
+    """
+    Closes this thread's pooled connections.
+    """
+    for conn in getattr(_connections, "by_path", {}).values():
+        conn.close()
+    _connections.by_path = {}
+
+
+def use_database(db_path):
+    """
+    Makes db_path the database used by every call that is not given a path, returning the previous one.
+    """
+    global _database_path
+    previous, _database_path = _database_path, db_path
+    return previous
+
+
+def backup_database(target_path):
+    """
+    Copies the current database to target_path, replacing it. Safe while other connections are open.
+    """
+    conn, _ = _connect_to_database()
+    target = sqlite3.connect(target_path)
+    try:
+        conn.backup(target)
+    finally:
+        target.close()
+        _release(conn)
 
 
 def open_position(exchange, pair_1, pair_2, open_position_amount):
@@ -21,7 +86,6 @@ def open_position(exchange, pair_1, pair_2, open_position_amount):
     :param pair_2: The second trading pair (e.g., 'USDT/BTC').
     :param open_position_amount: The amount of the open position.
     """
-    db_path = DATABASE_PATH
     conn = None
     try:
 
@@ -47,13 +111,12 @@ def open_position(exchange, pair_1, pair_2, open_position_amount):
         # Get current UTC time
 
         # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        conn, cursor = _connect_to_database()
 
         # Insert the open position into the position table
         cursor.execute("""
             INSERT INTO position (base_currency, quote_currency, secondary_currency, open_position)
-            VALUES (?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?)
         """, (base_currency_1, common_quote_currency, secondary_currency, open_position_amount))
 
         # Commit the transaction
@@ -68,7 +131,7 @@ def open_position(exchange, pair_1, pair_2, open_position_amount):
         print(f"Error: {e}")
     finally:
         if conn:
-            conn.close()
+            _release(conn)
 
 
 def close_position_by_id(db_path, position_id, closed_position_amount):
@@ -81,7 +144,7 @@ def close_position_by_id(db_path, position_id, closed_position_amount):
     """
     conn = None
     try:
-        conn, cursor = _connect_to_database()
+        conn, cursor = _connect_to_database(db_path)
 
         # Get current UTC time
         close_timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
@@ -127,17 +190,51 @@ def close_position_by_id(db_path, position_id, closed_position_amount):
     finally:
         # Close the database connection
         if conn:
-            conn.close()
+            _release(conn)
 
+@timed("bot_db_write_seconds", table="cointegrated_pairs")
 def store_cointegrated_markets(pairs):
+    """
+    Replaces the stored cointegrated pairs with the result of a full scan.
+    """
     conn, cursor = None, None
     try:
         conn, cursor = _connect_to_database()
-        pairs.to_sql('cointegrated_pairs', conn, if_exists='replace', index=False)
+        cursor.execute("DELETE FROM cointegrated_pairs")
+        cursor.executemany("""
+            INSERT INTO cointegrated_pairs (first_market, second_market, hedge_ratio, half_life)
+            VALUES (?, ?, ?, ?)
+        """, pairs[["first_market", "second_market", "hedge_ratio", "half_life"]].itertuples(index=False, name=None))
         conn.commit()
     finally:
         if conn:
-            conn.close()
+            _release(conn)
+
+
+@timed("bot_db_write_seconds", table="cointegrated_pairs")
+def upsert_cointegrated_markets(pairs, removed_pairs):
+    """
+    Upserts pairs that passed an incremental refresh and deletes pairs that no longer qualify.
+
+    :param pairs: DataFrame with first_market, second_market, hedge_ratio and half_life columns.
+    :param removed_pairs: List of (first_market, second_market) tuples to delete.
+    """
+    conn, cursor = None, None
+    try:
+        conn, cursor = _connect_to_database()
+        cursor.executemany("""
+            INSERT INTO cointegrated_pairs (first_market, second_market, hedge_ratio, half_life)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (first_market, second_market) DO UPDATE
+            SET hedge_ratio = excluded.hedge_ratio, half_life = excluded.half_life
+        """, pairs[["first_market", "second_market", "hedge_ratio", "half_life"]].itertuples(index=False, name=None))
+        cursor.executemany("""
+            DELETE FROM cointegrated_pairs WHERE first_market = ? AND second_market = ?
+        """, removed_pairs)
+        conn.commit()
+    finally:
+        if conn:
+            _release(conn)
 
 def get_cointegrated_markets():
     conn, cursor = None, None
@@ -148,4 +245,304 @@ def get_cointegrated_markets():
 
     finally:
         if conn:
-            conn.close()
\ No newline at end of file
+            _release(conn)
+
+
+def get_table_version(name):
+    """
+    Returns the change counter kept for a table by its triggers, or None when it is not tracked.
+    """
+    conn = None
+    try:
+        conn, cursor = _connect_to_database()
+        cursor.execute("SELECT version FROM table_version WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    finally:
+        if conn:
+            _release(conn)
+
+def get_pair_tests():
+    """
+    Returns every pair recorded by the incremental refresh with the age of its last test in hours.
+    """
+    conn, cursor = None, None
+    try:
+        conn, cursor = _connect_to_database()
+        return pd.read_sql_query("""
+            SELECT first_market, second_market, cointegrated, data_start, data_end,
+                   (julianday('now') - julianday(tested_at)) * 24 AS age_hours
+            FROM pair_test
+        """, conn)
+    finally:
+        if conn:
+            _release(conn)
+
+
+@timed("bot_db_write_seconds", table="pair_test")
+def upsert_pair_tests(tests):
+    """
+    Records test results with the data range they were computed on.
+
+    :param tests: DataFrame with first_market, second_market, cointegrated, hedge_ratio, half_life,
+        data_start and data_end columns.
+    """
+    conn, cursor = None, None
+    try:
+        conn, cursor = _connect_to_database()
+        columns = ["first_market", "second_market", "cointegrated", "hedge_ratio", "half_life", "data_start",
+                   "data_end"]
+        cursor.executemany("""
+            INSERT INTO pair_test (first_market, second_market, cointegrated, hedge_ratio, half_life,
+                                   data_start, data_end, tested_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))
+            ON CONFLICT (first_market, second_market) DO UPDATE
+            SET cointegrated = excluded.cointegrated, hedge_ratio = excluded.hedge_ratio,
+                half_life = excluded.half_life, data_start = excluded.data_start,
+                data_end = excluded.data_end, tested_at = excluded.tested_at
+        """, tests[columns].astype(object).itertuples(index=False, name=None))
+        conn.commit()
+    finally:
+        if conn:
+            _release(conn)
+
+
+@timed("bot_db_write_seconds", table="candle")
+def store_candles(market, resolution, candles):
+    """
+    Upserts ccxt ohlcv rows for a market. The newest stored bar may still have been forming
+    when it was fetched, so existing rows are replaced rather than ignored.
+
+    :param market: ccxt symbol (e.g., 'ETH/BTC').
+    :param resolution: ccxt timeframe (e.g., '1h').
+    :param candles: List of [timestamp, open, high, low, close, volume] rows.
+    """
+    conn = None
+    try:
+        conn, cursor = _connect_to_database()
+        cursor.executemany("""
+            INSERT OR REPLACE INTO candle (market, resolution, timestamp, open, high, low, close, volume)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(market, resolution, int(c[0]), c[1], c[2], c[3], c[4], c[5] or 0.0) for c in candles])
+        conn.commit()
+    finally:
+        if conn:
+            _release(conn)
+
+
+def get_candle_range(market, resolution, since=None):
+    """
+    Returns (first timestamp, last timestamp) of stored bars for a market from `since` (ms) onwards,
+    or (None, None) when nothing is stored.
+    """
+    conn = None
+    try:
+        conn, cursor = _connect_to_database()
+        cursor.execute("""
+            SELECT MIN(timestamp), MAX(timestamp) FROM candle
+            WHERE market = ? AND resolution = ? AND timestamp >= ?
+        """, (market, resolution, since or 0))
+        return cursor.fetchone()
+    finally:
+        if conn:
+            _release(conn)
+
+
+def get_candle_start(market, resolution):
+    """
+    Returns the open time (ms) of the earliest bar the exchange has for a market, or None if not recorded.
+    """
+    conn = None
+    try:
+        conn, cursor = _connect_to_database()
+        cursor.execute("SELECT timestamp FROM candle_start WHERE market = ? AND resolution = ?", (market, resolution))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    finally:
+        if conn:
+            _release(conn)
+
+
+def store_candle_start(market, resolution, timestamp):
+    """
+    Records the open time (ms) of the earliest bar the exchange has for a market.
+    """
+    conn = None
+    try:
+        conn, cursor = _connect_to_database()
+        cursor.execute("INSERT OR REPLACE INTO candle_start (market, resolution, timestamp) VALUES (?, ?, ?)",
+                       (market, resolution, timestamp))
+        conn.commit()
+    finally:
+        if conn:
+            _release(conn)
+
+
+def get_candles(market, resolution, since=None):
+    """
+    Returns stored ohlcv rows for a market in ascending time order, optionally from `since` (ms) onwards.
+    """
+    conn = None
+    try:
+        conn, cursor = _connect_to_database()
+        cursor.execute("""
+            SELECT timestamp, open, high, low, close, volume FROM candle
+            WHERE market = ? AND resolution = ? AND timestamp >= ?
+            ORDER BY timestamp
+        """, (market, resolution, since or 0))
+        return [list(row) for row in cursor.fetchall()]
+    finally:
+        if conn:
+            _release(conn)
+
+
+def get_candle_markets(resolution):
+    """
+    Returns the markets with stored bars at a resolution.
+    """
+    conn = None
+    try:
+        conn, cursor = _connect_to_database()
+        cursor.execute("SELECT DISTINCT market FROM candle WHERE resolution = ? ORDER BY market", (resolution,))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        if conn:
+            _release(conn)
+
+
+def delete_candles_after(resolution, timestamp):
+    """
+    Deletes stored bars at a resolution that open after `timestamp` (ms).
+    """
+    conn = None
+    try:
+        conn, cursor = _connect_to_database()
+        cursor.execute("DELETE FROM candle WHERE resolution = ? AND timestamp > ?", (resolution, timestamp))
+        conn.commit()
+    finally:
+        if conn:
+            _release(conn)
+
+
+def clear_pair_state():
+    """
+    Deletes stored pair tests, cointegrated pairs and pair positions, keeping the candles.
+    """
+    conn = None
+    try:
+        conn, cursor = _connect_to_database()
+        for table in ("pair_test", "cointegrated_pairs", "pair_position"):
+            cursor.execute(f"DELETE FROM {table}")
+        conn.commit()
+    finally:
+        if conn:
+            _release(conn)
+
+
+PAIR_POSITION_COLUMNS = ["market_1", "market_2", "hedge_ratio", "z_score", "half_life", "order_id_m1", "order_m1_size",
+                         "order_m1_side", "order_time_m1", "order_id_m2", "order_m2_size", "order_m2_side",
+                         "order_time_m2", "pair_status", "comments"]
+
+
+@timed("bot_db_write_seconds", table="pair_position")
+def insert_pair_positions(order_dicts):
+    """
+    Records opened pairs in one transaction and returns their ids.
+
+    :param order_dicts: BotAgent order dicts, keyed by PAIR_POSITION_COLUMNS.
+    """
+    conn = None
+    try:
+        conn, cursor = _connect_to_database()
+        ids = []
+        for order_dict in order_dicts:
+            cursor.execute(f"""
+                INSERT INTO pair_position ({", ".join(PAIR_POSITION_COLUMNS)})
+                VALUES ({", ".join("?" * len(PAIR_POSITION_COLUMNS))})
+            """, [order_dict.get(column) for column in PAIR_POSITION_COLUMNS])
+            ids.append(cursor.lastrowid)
+        conn.commit()
+        return ids
+    finally:
+        if conn:
+            _release(conn)
+
+
+def get_live_pair_positions():
+    """
+    Returns every live pair as a dict with id plus the PAIR_POSITION_COLUMNS fields, oldest first.
+    """
+    conn = None
+    try:
+        conn, cursor = _connect_to_database()
+        cursor.row_factory = sqlite3.Row
+        rows = cursor.execute(f"""
+            SELECT id, {", ".join(PAIR_POSITION_COLUMNS)} FROM pair_position
+            WHERE pair_status = 'LIVE'
+            ORDER BY id
+        """).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        if conn:
+            _release(conn)
+
+
+@timed("bot_db_write_seconds", table="pair_position")
+def close_pair_positions(position_ids):
+    """
+    Marks pairs as exited.
+
+    :param position_ids: Ids of the pair_position rows to close.
+    """
+    conn = None
+    try:
+        conn, cursor = _connect_to_database()
+        cursor.executemany("""
+            UPDATE pair_position SET pair_status = 'CLOSE', closed_at = datetime('now')
+            WHERE id = ? AND pair_status = 'LIVE'
+        """, [(position_id,) for position_id in position_ids])
+        conn.commit()
+    finally:
+        if conn:
+            _release(conn)
+
+
+def is_market_in_live_pair(market):
+    """
+    Returns True when either leg of a live pair trades the market, using the partial market indexes.
+    """
+    conn = None
+    try:
+        conn, cursor = _connect_to_database()
+        cursor.execute("""
+            SELECT EXISTS (SELECT 1 FROM pair_position WHERE market_1 = ? AND pair_status = 'LIVE')
+                OR EXISTS (SELECT 1 FROM pair_position WHERE market_2 = ? AND pair_status = 'LIVE')
+        """, (market, market))
+        return bool(cursor.fetchone()[0])
+    finally:
+        if conn:
+            _release(conn)
+
+
+SWEEP_RESULT_COLUMNS = ["run_id", "window", "zscore_thresh", "max_half_life", "p_value_cutoff", "fold", "train_start",
+                        "test_start", "test_end", "pairs", "trades", "wins", "pnl", "max_drawdown"]
+
+
+@timed("bot_db_write_seconds", table="sweep_result")
+def store_sweep_results(results):
+    """
+    Inserts parameter sweep rows, replacing any earlier row for the same run, setting and fold.
+
+    :param results: DataFrame with SWEEP_RESULT_COLUMNS columns.
+    """
+    conn = None
+    try:
+        conn, cursor = _connect_to_database()
+        cursor.executemany(f"""
+            INSERT OR REPLACE INTO sweep_result ({", ".join(SWEEP_RESULT_COLUMNS)})
+            VALUES ({", ".join("?" * len(SWEEP_RESULT_COLUMNS))})
+        """, results[SWEEP_RESULT_COLUMNS].astype(object).itertuples(index=False, name=None))
+        conn.commit()
+    finally:
+        if conn:
+            _release(conn)
@@ -0,0 +1,143 @@
+import asyncio
+import random
+import time
+import weakref
+
+import ccxt.async_support as ccxt
+
+from constants import MAX_CONCURRENT_REQUESTS, REQUEST_RETRIES, RETRY_BACKOFF_SECONDS, OHLCV_REQUEST_COST
+from func_metrics import count, observe
+
+
+# Token bucket sized from the exchange rate limit
+class TokenBucket:
+    """
+        Async token bucket. Tokens refill continuously at refill_rate per second up to capacity.
+        Waiters are served in arrival order so a heavy request cannot be starved.
+    """
+
+    def __init__(self, refill_rate, capacity=1):
+        self.refill_rate = refill_rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    @classmethod
+    def from_exchange(cls, client, capacity=MAX_CONCURRENT_REQUESTS):
+        # ccxt rateLimit is milliseconds per unit of request weight
+        rate_limit = getattr(client, "rateLimit", 0) or 0
+        refill_rate = 1000 / rate_limit if rate_limit > 0 else float("inf")
+        return cls(refill_rate, capacity)
+
+    async def acquire(self, cost=1):
+        cost = min(cost, self.capacity)
+        requested = time.monotonic()
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+                self.updated = now
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    observe("bot_rate_limit_wait_seconds", now - requested)
+                    return
+                await asyncio.sleep((cost - self.tokens) / self.refill_rate)
+
+
+# One bucket per client so nested downloads share the exchange budget
+_buckets = weakref.WeakKeyDictionary()
+
+
+def get_bucket(client):
+    if client not in _buckets:
+        _buckets[client] = TokenBucket.from_exchange(client)
+    return _buckets[client]
+
+
+# Outcome of fetching a single market
+class FetchResult:
+    def __init__(self, market, latency, attempts, error=None):
+        self.market = market
+        self.latency = latency
+        self.attempts = attempts
+        self.error = error
+
+
+# Per-market latency and failures for one download run
+class DownloadReport:
+    def __init__(self):
+        self.results = []
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    @property
+    def failures(self):
+        return [r for r in self.results if r.error is not None]
+
+    @property
+    def retries(self):
+        return sum(r.attempts - 1 for r in self.results)
+
+    def slowest(self, n=5):
+        return sorted(self.results, key=lambda r: r.latency, reverse=True)[:n]
+
+    def summary(self):
+        ok = len(self.results) - len(self.failures)
+        latencies = sorted(r.latency for r in self.results)
+        median = latencies[len(latencies) // 2] if latencies else 0.0
+        lines = [f"Downloaded {ok}/{len(self.results)} markets in {self.elapsed:.2f}s "
+                 f"(median {median:.3f}s, retries {self.retries})"]
+        if self.results:
+            lines.append("Slowest: " + ", ".join(f"{r.market} {r.latency:.3f}s" for r in self.slowest()))
+        for r in self.failures:
+            lines.append(f"Failed {r.market} after {r.attempts} attempts - {r.error}")
+        return "\n".join(lines)
+
+
+async def _fetch_with_retry(client, market, fetch, bucket, semaphore, cost):
+    attempts = 0
+    started = time.monotonic()
+    async with semaphore:
+        while True:
+            attempts += 1
+            await bucket.acquire(cost)
+            try:
+                data = await fetch(client, market)
+                return data, FetchResult(market, time.monotonic() - started, attempts)
+            except ccxt.NetworkError as e:
+                # Timeouts, DDoS protection and rate limit responses are worth another go
+                if attempts > REQUEST_RETRIES:
+                    count("bot_download_failures_total", error=type(e).__name__)
+                    return None, FetchResult(market, time.monotonic() - started, attempts, e)
+                count("bot_download_retries_total", error=type(e).__name__)
+                backoff = RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+                await asyncio.sleep(backoff + random.uniform(0, backoff / 2))
+            except Exception as e:
+                count("bot_download_failures_total", error=type(e).__name__)
+                return None, FetchResult(market, time.monotonic() - started, attempts, e)
+
+
+# Fetch data for many markets concurrently
+async def download_markets(client, markets, fetch, max_concurrent=MAX_CONCURRENT_REQUESTS, cost=OHLCV_REQUEST_COST,
+                           bucket=None):
+    """
+        Run fetch(client, market) for every market with at most max_concurrent calls in flight,
+        paced by a token bucket built from the exchange rateLimit and retried with backoff.
+        Returns a dict of market -> data for the successful markets and a DownloadReport.
+    """
+    bucket = bucket or get_bucket(client)
+    semaphore = asyncio.Semaphore(max_concurrent)
+    report = DownloadReport()
+
+    outcomes = await asyncio.gather(
+        *[_fetch_with_retry(client, market, fetch, bucket, semaphore, cost) for market in markets]
+    )
+
+    data = {}
+    for market, (result, fetch_result) in zip(markets, outcomes):
+        report.results.append(fetch_result)
+        if fetch_result.error is None:
+            data[market] = result
+    report.elapsed = time.monotonic() - report.started
+    return data, report
@@ -1,16 +1,35 @@
 from constants import ZSCORE_THRESH, USD_PER_TRADE, USD_MIN_COLLATERAL
 from func_utils import format_number
-from func_cointegration import calculate_zscore
-from func_public import get_candles_recent, get_markets
+from func_cointegration import latest_pair_zscores
+from func_public import get_price_snapshot
+from func_markets import get_market_cache
+from func_stream import get_bar_cache
+from func_database import insert_pair_positions
 from func_private import is_open_positions, get_account
 from func_bot_agent import BotAgent
-import pandas as pd
-import json
+from func_execution import claim_markets, release_markets, execute_agents
+from func_pair_registry import get_pair_registry
+from func_metrics import count
+import numpy as np
 
 from pprint import pprint
 
 IGNORE_ASSETS = ["BTC-USD_x", "BTC-USD_y"] # Ignore these assets which are not trading on testnet
 
+# Save a live pair for the exit phase
+async def save_bot_agent(bot_open_dict):
+
+  # Guard: Handle failure
+  if bot_open_dict["pair_status"] != "LIVE":
+    return
+
+  # Save trade
+  insert_pair_positions([bot_open_dict])
+
+  # Confirm live status in print
+  print("Trade status: Live")
+  print("---")
+
 # Open positions
 async def open_positions(client):
 
@@ -19,150 +38,138 @@ async def open_positions(client):
     Store trades for managing later on on exit function
   """
 
-  # Load cointegrated pairs
-  df = pd.read_csv("cointegrated_pairs.csv")
+  # Load cointegrated pairs - only re-read when the pairs table has changed
+  registry = get_pair_registry()
 
   # Get markets from referencing of min order size, tick size etc
-  markets = await get_markets(client)
-
-  # Initialize container for BotAgent results
-  bot_agents = []
-
-  # Opening JSON file
+  market_cache = await get_market_cache(client)
+
+  # Continue if ignore asset, and keep pairs whose markets are still active
+  tradable = registry.market_mask(market_cache.markets) & ~registry.market_mask(IGNORE_ASSETS)
+  pairs = np.flatnonzero(registry.pair_mask(tradable))
+
+  # Get prices - from the stream cache when streaming, otherwise each market is fetched once, concurrently
+  pair_markets = registry.markets[np.unique(np.concatenate([registry.first[pairs], registry.second[pairs]]))]
+  bar_cache = get_bar_cache()
+  prices = bar_cache.snapshot(pair_markets) if bar_cache else await get_price_snapshot(client, pair_markets)
+  columns = np.array([prices.column.get(market, -1) for market in registry.markets], dtype=np.int64)
+  pairs = pairs[(columns[registry.first[pairs]] >= 0) & (columns[registry.second[pairs]] >= 0)]
+
+  # Get ZScore for every pair against the shared snapshot
+  z_scores = latest_pair_zscores(
+    prices.values,
+    columns[registry.first[pairs]],
+    columns[registry.second[pairs]],
+    registry.hedge_ratio[pairs],
+  )
+
+  # Agents to run once every trigger has been checked
+  pending_agents = []
+  free_collateral = None
+
+  # Claimed markets are released by execute_agents once it takes the agents, or below if an await fails first
   try:
-    open_positions_file = open("bot_agents.json")
-    open_positions_dict = json.load(open_positions_file)
-    for p in open_positions_dict:
-      bot_agents.append(p)
-  except:
-    bot_agents = []
-  
-  # Find ZScore triggers
-  for index, row in df.iterrows():
-
-    # Extract variables
-    first_market = row["first_market"]
-    second_market = row["second_market"]
-    hedge_ratio = row["hedge_ratio"]
-    half_life = row["half_life"]
-
-    # Continue if ignore asset
-    if first_market in IGNORE_ASSETS or second_market in IGNORE_ASSETS:
-      continue
-
-    # Get prices
-    try:
-      series_1 = await get_candles_recent(client, first_market)
-      series_2 = await get_candles_recent(client, second_market)
-    except Exception as e:
-      print(e)
-      continue
-
-    # Get ZScore
-    if len(series_1) > 0 and len(series_1) == len(series_2):
-      spread = series_1 - (hedge_ratio * series_2)
-      z_score = calculate_zscore(spread).values.tolist()[-1]
-
-      # Establish if potential trade
-      # Establish if potential trade
-      if abs(z_score) >= ZSCORE_THRESH:
-
-        # Ensure like-for-like not already open (diversify trading)
-        is_base_open = await is_open_positions(client, first_market)
-        is_quote_open = await is_open_positions(client, second_market)
-
-        # Place trade
-        if not is_base_open and not is_quote_open:
-
-          # Determine side
-          base_side = "BUY" if z_score < 0 else "SELL"
-          quote_side = "BUY" if z_score > 0 else "SELL"
-
-          # Get acceptable price in string format with correct number of decimals
-          base_price = series_1[-1]
-          quote_price = series_2[-1]
-          accept_base_price = float(base_price) * 1.01 if z_score < 0 else float(base_price) * 0.99
-          accept_quote_price = float(quote_price) * 1.01 if z_score > 0 else float(quote_price) * 0.99
-          failsafe_base_price = float(base_price) * 0.05 if z_score < 0 else float(base_price) * 1.7
-          base_tick_size = markets["markets"][first_market]["tickSize"]
-          quote_tick_size = markets["markets"][second_market]["tickSize"]
-
-          # Format prices
-          accept_base_price = format_number(accept_base_price, base_tick_size)
-          accept_quote_price = format_number(accept_quote_price, quote_tick_size)
-          accept_failsafe_base_price = format_number(failsafe_base_price, base_tick_size)
-
-          # Get size
-          base_quantity = 1 / base_price * USD_PER_TRADE
-          quote_quantity = 1 / quote_price * USD_PER_TRADE
-          base_step_size = markets["markets"][first_market]["stepSize"]
-          quote_step_size = markets["markets"][second_market]["stepSize"]
-
-          # Format sizes
-          base_size = format_number(base_quantity, base_step_size)
-          quote_size = format_number(quote_quantity, quote_step_size)
-
-          # Ensure size (minimum order size greater than $1 according to V4 documentation)
-          base_min_order_size = 1 / float(markets["markets"][first_market]["oraclePrice"])
-          quote_min_order_size = 1 / float(markets["markets"][second_market]["oraclePrice"])
-
-          # Combine checks
-          check_base = float(base_quantity) > base_min_order_size
-          check_quote = float(quote_quantity) > quote_min_order_size
-
-          # If checks pass, place trades
-          if check_base and check_quote:
-
-            # Check account balance
+
+    # Find ZScore triggers
+    triggered = np.abs(z_scores) >= ZSCORE_THRESH
+    count("bot_pairs_evaluated_total", len(pairs))
+    count("bot_entry_triggers_total", int(triggered.sum()))
+    for pair, z_score in zip(pairs[triggered], z_scores[triggered]):
+
+      # Extract variables
+      first_market = registry.markets[registry.first[pair]]
+      second_market = registry.markets[registry.second[pair]]
+      hedge_ratio = float(registry.hedge_ratio[pair])
+      half_life = float(registry.half_life[pair])
+      z_score = float(z_score)
+      series_1 = prices.series(first_market)
+      series_2 = prices.series(second_market)
+
+      # Ensure like-for-like not already open (diversify trading)
+      is_base_open = await is_open_positions(client, first_market)
+      is_quote_open = await is_open_positions(client, second_market)
+
+      # Place trade
+      if not is_base_open and not is_quote_open:
+
+        # Determine side
+        base_side = "BUY" if z_score < 0 else "SELL"
+        quote_side = "BUY" if z_score > 0 else "SELL"
+
+        # Get acceptable price in string format with correct number of decimals
+        base_price = series_1[-1]
+        quote_price = series_2[-1]
+        accept_base_price = float(base_price) * 1.01 if z_score < 0 else float(base_price) * 0.99
+        accept_quote_price = float(quote_price) * 1.01 if z_score > 0 else float(quote_price) * 0.99
+        failsafe_base_price = float(base_price) * 0.05 if z_score < 0 else float(base_price) * 1.7
+        failsafe_quote_price = float(quote_price) * 0.05 if z_score > 0 else float(quote_price) * 1.7
+        base_info = market_cache.get(first_market)
+        quote_info = market_cache.get(second_market)
+        base_tick_size = base_info.tick_size
+        quote_tick_size = quote_info.tick_size
+
+        # Format prices
+        accept_base_price = format_number(accept_base_price, base_tick_size)
+        accept_quote_price = format_number(accept_quote_price, quote_tick_size)
+        accept_failsafe_base_price = format_number(failsafe_base_price, base_tick_size)
+        accept_failsafe_quote_price = format_number(failsafe_quote_price, quote_tick_size)
+
+        # Get size
+        base_quantity = 1 / base_price * USD_PER_TRADE
+        quote_quantity = 1 / quote_price * USD_PER_TRADE
+        base_step_size = base_info.step_size
+        quote_step_size = quote_info.step_size
+
+        # Format sizes
+        base_size = format_number(base_quantity, base_step_size)
+        quote_size = format_number(quote_quantity, quote_step_size)
+
+        # Ensure size meets the exchange minimum order size and value
+        check_base = base_info.is_order_allowed(float(base_size), float(base_price))
+        check_quote = quote_info.is_order_allowed(float(quote_size), float(quote_price))
+
+        # If checks pass, place trades
+        if check_base and check_quote:
+
+          # Check account balance once, then reserve collateral for each pair about to trade
+          if free_collateral is None:
             account = await get_account(client)
             free_collateral = float(account["freeCollateral"])
             print(f"Balance: {free_collateral} and minimum at {USD_MIN_COLLATERAL}")
 
-            # Guard: Ensure collateral
-            if free_collateral < USD_MIN_COLLATERAL:
-              break
-
-            # Create Bot Agent
-            bot_agent = BotAgent(
-              client,
-              market_1=first_market,
-              market_2=second_market,
-              base_side=base_side,
-              base_size=base_size,
-              base_price=accept_base_price,
-              quote_side=quote_side,
-              quote_size=quote_size,
-              quote_price=accept_quote_price,
-              accept_failsafe_base_price=accept_failsafe_base_price,
-              z_score=z_score,
-              half_life=half_life,
-              hedge_ratio=hedge_ratio
-            )
-
-            # Open Trades
-            bot_open_dict = await bot_agent.open_trades()
-
-            # Guard: Handle failure
-            if bot_open_dict == "failed":
-              continue
-
-            # Handle success in opening trades
-            if bot_open_dict["pair_status"] == "LIVE":
-
-              # Append to list of bot agents
-              bot_agents.append(bot_open_dict)
-              del(bot_open_dict)
-
-              # Save trade
-              with open("bot_agents.json", "w") as f:
-                json.dump(bot_agents, f)
-
-              # Confirm live status in print
-              print("Trade status: Live")
-              print("---")
-
-  # Save agents
+          # Guard: Ensure collateral
+          if free_collateral < USD_MIN_COLLATERAL:
+            break
+
+          # Guard: Skip if another agent is trading either market
+          if not claim_markets((first_market, second_market)):
+            continue
+          free_collateral -= 2 * USD_PER_TRADE
+
+          # Create Bot Agent
+          bot_agent = BotAgent(
+            client,
+            market_1=first_market,
+            market_2=second_market,
+            base_side=base_side,
+            base_size=base_size,
+            base_price=accept_base_price,
+            quote_side=quote_side,
+            quote_size=quote_size,
+            quote_price=accept_quote_price,
+            accept_failsafe_base_price=accept_failsafe_base_price,
+            z_score=z_score,
+            half_life=half_life,
+            hedge_ratio=hedge_ratio,
+            accept_failsafe_quote_price=accept_failsafe_quote_price,
+          )
+          pending_agents.append(bot_agent)
+
+    # Open Trades - all triggered pairs at once, each saved as soon as it is live
+    bot_agents, pending_agents = pending_agents, []
+    await execute_agents(bot_agents, on_result=save_bot_agent)
+  finally:
+    for bot_agent in pending_agents:
+      release_markets((bot_agent.market_1, bot_agent.market_2))
+
   print(f"Success: Manage open trades checked")
-  # if len(bot_agents) > 0:
-  #   with open("bot_agents.json", "w") as f:
-  #     json.dump(bot_agents, f)
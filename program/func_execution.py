@@ -0,0 +1,49 @@
+import asyncio
+
+from constants import MAX_CONCURRENT_AGENTS, SUBMIT_LEGS_TOGETHER
+
+# Markets with an agent in flight, so two agents never trade the same asset at once
+_claimed_markets = set()
+
+
+# Claim every market of a pair, or none of them if any is already being traded
+def claim_markets(markets):
+    """
+        Non-blocking: returns False instead of waiting, so a pair whose asset is busy is skipped
+        for this signal rather than traded later on a stale price. Runs without awaiting, so the
+        check and the claim cannot interleave with another task.
+    """
+    if any(market in _claimed_markets for market in markets):
+        return False
+    _claimed_markets.update(markets)
+    return True
+
+
+def release_markets(markets):
+    _claimed_markets.difference_update(markets)
+
+
+async def _run_agent(bot_agent, semaphore, on_result):
+    markets = (bot_agent.market_1, bot_agent.market_2)
+    try:
+        async with semaphore:
+            if SUBMIT_LEGS_TOGETHER:
+                result = await bot_agent.open_trades_together()
+            else:
+                result = await bot_agent.open_trades()
+        if on_result:
+            await on_result(result)
+        return result
+    finally:
+        release_markets(markets)
+
+
+# Open many pairs concurrently
+async def execute_agents(bot_agents, on_result=None, max_concurrent=MAX_CONCURRENT_AGENTS):
+    """
+        Runs open_trades for each agent with at most max_concurrent in flight. Each agent's
+        markets must already be claimed with claim_markets; they are released when it finishes.
+        on_result is awaited with each agent's result as soon as that agent completes.
+    """
+    semaphore = asyncio.Semaphore(max_concurrent)
+    return await asyncio.gather(*[_run_agent(bot_agent, semaphore, on_result) for bot_agent in bot_agents])
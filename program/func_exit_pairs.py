@@ -1,10 +1,14 @@
-from constants import CLOSE_AT_ZSCORE_CROSS
-from func_utils import format_number
-from func_cointegration import calculate_zscore
-from func_public import get_candles_recent, get_markets
-from func_private import place_market_order, get_open_positions, get_order
-import json
-import time
+from constants import CLOSE_AT_ZSCORE_CROSS, WINDOW
+from func_utils import format_number, as_awaitable
+from func_cointegration import latest_pair_zscores
+from func_public import get_price_snapshot
+from func_markets import get_market_cache
+from func_private import place_market_order, get_exchange_snapshot
+from func_stream import get_bar_cache
+from func_database import get_live_pair_positions, close_pair_positions
+from func_metrics import count
+import asyncio
+import numpy as np
 
 from pprint import pprint
 
@@ -16,32 +20,52 @@ async def manage_trade_exits(client):
     Based upon criteria set in constants
   """
 
-  # Initialize saving output
-  save_output = []
-
-  # Opening JSON file
-  try:
-    open_positions_file = open("bot_agents.json")
-    open_positions_dict = json.load(open_positions_file)
-  except:
-    return "complete"
+  # Get live pairs
+  open_positions_dict = get_live_pair_positions()
 
   # Guard: Exit if no open positions in file
   if len(open_positions_dict) < 1:
     return "complete"
 
-  # Get all open positions per trading platform
-  exchange_pos = await get_open_positions(client)
+  # Markets and orders referenced by the saved positions
+  position_markets = sorted({p["market_1"] for p in open_positions_dict} | {p["market_2"] for p in open_positions_dict})
+  position_orders = [(p[f"order_id_m{leg}"], p[f"market_{leg}"]) for p in open_positions_dict for leg in (1, 2)]
 
-  # Create live position tickers list
-  markets_live = list(exchange_pos.keys())
+  # Get orders, balances, prices and market rules for every position at once
+  bar_cache = get_bar_cache()
+  snapshot, prices, market_cache = await asyncio.gather(
+    get_exchange_snapshot(client, position_markets, position_orders),
+    as_awaitable(bar_cache.snapshot(position_markets)) if bar_cache else get_price_snapshot(client, position_markets),
+    get_market_cache(client),
+  )
 
-  # Protect API
-  time.sleep(0.5)
+  # Create live position tickers list
+  markets_live = snapshot.markets_live
+
+  # Get ZScore for every position against the shared snapshot
+  # A position is priced when both markets have a full window of recent closes, which a stream cache may not yet hold
+  complete = ~np.isnan(prices.values[-WINDOW:]).any(axis=0) if len(prices.timestamps) >= WINDOW \
+    else np.zeros(len(prices.markets), dtype=bool)
+  priced = [
+    p["market_1"] in prices.column and p["market_2"] in prices.column
+    and complete[prices.column[p["market_1"]]] and complete[prices.column[p["market_2"]]]
+    for p in open_positions_dict
+  ]
+  z_scores = np.full(len(open_positions_dict), np.nan)
+  if any(priced):
+    priced_positions = [p for p, ok in zip(open_positions_dict, priced) if ok]
+    z_scores[np.flatnonzero(priced)] = latest_pair_zscores(
+      prices.values,
+      [prices.column[p["market_1"]] for p in priced_positions],
+      [prices.column[p["market_2"]] for p in priced_positions],
+      [p["hedge_ratio"] for p in priced_positions],
+    )
+
+  count("bot_positions_checked_total", len(open_positions_dict))
 
   # Check all saved positions match order record
   # Exit trade according to any exit trade rules
-  for position in open_positions_dict:
+  for position, z_score_current, position_priced in zip(open_positions_dict, z_scores, priced):
 
     # Initialize is_close trigger
     is_close = False
@@ -56,20 +80,19 @@ async def manage_trade_exits(client):
     position_size_m2 = position["order_m2_size"]
     position_side_m2 = position["order_m2_side"]
 
-    # Protect API
-    time.sleep(0.5)
+    # Get order info for both legs from the snapshot
+    order_m1 = snapshot.get_order(position["order_id_m1"])
+    order_m2 = snapshot.get_order(position["order_id_m2"])
+
+    # Guard: If an order is unknown to the exchange exit with error
+    if order_m1 is None or order_m2 is None:
+      print(f"Warning: Orders for {position_market_m1} and {position_market_m2} not found on the exchange")
+      print(f"Exiting program")
+      exit(1)
 
-    # Get order info m1 per exchange
-    order_m1 = await get_order(client, position["order_id_m1"])
     order_market_m1 = order_m1["ticker"]
     order_size_m1 = order_m1["size"]
     order_side_m1 = order_m1["side"]
-
-    # Protect API Rate limits
-    time.sleep(0.5)
-
-    # Get order info m2 per exchange
-    order_m2 = await get_order(client, position["order_id_m2"])
     order_market_m2 = order_m2["ticker"]
     order_size_m2 = order_m2["size"]
     order_side_m2 = order_m2["side"]
@@ -91,27 +114,16 @@ async def manage_trade_exits(client):
       print(f"Exiting program")
       exit(1)
 
-    # Get prices
-    series_1 = await get_candles_recent(client, position_market_m1)
-    time.sleep(0.2)
-    series_2 = await get_candles_recent(client, position_market_m2)
-    time.sleep(0.2)
-
-    # Get markets for reference of tick size
-    markets = await get_markets(client)
-
-    # Protect API
-    time.sleep(0.2)
+    # Guard: Skip the pair until both markets have enough prices to score and close it
+    if not position_priced:
+      print(f"Skipping {position_market_m1} with {position_market_m2}: fewer than {WINDOW} recent prices to score the pair")
+      continue
 
     # Trigger close based on Z-Score
-    if CLOSE_AT_ZSCORE_CROSS:
+    if CLOSE_AT_ZSCORE_CROSS and not np.isnan(z_score_current):
 
       # Initialize z_scores
-      hedge_ratio = position["hedge_ratio"]
       z_score_traded = position["z_score"]
-      if len(series_1) > 0 and len(series_1) == len(series_2):
-        spread = series_1 - (hedge_ratio * series_2)
-        z_score_current = calculate_zscore(spread).values.tolist()[-1]
 
       # Determine trigger
       z_score_level_check = abs(z_score_current) >= abs(z_score_traded)
@@ -142,12 +154,12 @@ async def manage_trade_exits(client):
         side_m2 = "BUY"
 
       # Get and format Price
-      price_m1 = float(series_1[-1])
-      price_m2 = float(series_2[-1])
+      price_m1 = float(prices.series(position_market_m1)[-1])
+      price_m2 = float(prices.series(position_market_m2)[-1])
       accept_price_m1 = price_m1 * 1.05 if side_m1 == "BUY" else price_m1 * 0.95
       accept_price_m2 = price_m2 * 1.05 if side_m2 == "BUY" else price_m2 * 0.95
-      tick_size_m1 = markets["markets"][position_market_m1]["tickSize"]
-      tick_size_m2 = markets["markets"][position_market_m2]["tickSize"]
+      tick_size_m1 = market_cache.get(position_market_m1).tick_size
+      tick_size_m2 = market_cache.get(position_market_m2).tick_size
       accept_price_m1 = format_number(accept_price_m1, tick_size_m1)
       accept_price_m2 = format_number(accept_price_m2, tick_size_m2)
 
@@ -170,9 +182,6 @@ async def manage_trade_exits(client):
         print(close_order_m1["id"])
         print(">>> <<<")
 
-        # Protect API
-        time.sleep(1)
-
         # Close position for market 2
         print(">>> Closing market 2 <<<")
         print(f"Closing position for {position_market_m2}")
@@ -189,16 +198,12 @@ async def manage_trade_exits(client):
         print(close_order_m2["id"])
         print(">>> <<<")
 
+        # Record the exit
+        close_pair_positions([position["id"]])
+        count("bot_positions_closed_total")
+
       except Exception as e:
         print(e)
         print(f"Exit failed for {position_market_m1} with {position_market_m2}")
-        save_output.append(position)
-
-    # Keep record if items and save
-    else:
-      save_output.append(position)
 
-  # Save remaining items
-  print(f"{len(save_output)} Items remaining. Saving file...")
-  with open("bot_agents.json", "w") as f:
-    json.dump(save_output, f)
+  print(f"Success: Manage exits checked")
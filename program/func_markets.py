@@ -0,0 +1,128 @@
+import asyncio
+import json
+import os
+import time
+
+from ccxt.base.decimal_to_precision import number_to_string, TICK_SIZE, DECIMAL_PLACES
+
+from constants import QUOTE_CURRENCY, MARKET_CACHE_PATH, MARKET_CACHE_TTL_SECONDS
+
+
+# Trading rules for one market
+class MarketInfo:
+    """
+        tick_size and step_size are decimal strings, as format_number expects, min_notional is the
+        smallest order value in the quote currency and min_amount the smallest order size.
+    """
+    __slots__ = ("symbol", "tick_size", "step_size", "min_notional", "min_amount")
+
+    def __init__(self, symbol, tick_size, step_size, min_notional, min_amount):
+        self.symbol = symbol
+        self.tick_size = tick_size
+        self.step_size = step_size
+        self.min_notional = min_notional
+        self.min_amount = min_amount
+
+    @classmethod
+    def from_ccxt(cls, market, precision_mode=TICK_SIZE):
+        limits = market.get("limits") or {}
+        return cls(
+            market["symbol"],
+            _precision_to_string(market["precision"].get("price"), precision_mode),
+            _precision_to_string(market["precision"].get("amount"), precision_mode),
+            float((limits.get("cost") or {}).get("min") or 0),
+            float((limits.get("amount") or {}).get("min") or 0),
+        )
+
+    def to_row(self):
+        return [self.tick_size, self.step_size, self.min_notional, self.min_amount]
+
+    def is_order_allowed(self, size, price):
+        return size >= self.min_amount and size * price >= self.min_notional
+
+
+def _precision_to_string(precision, precision_mode=TICK_SIZE):
+    # In TICK_SIZE mode, as on binance, the precision is the increment itself, in DECIMAL_PLACES it is a digit count
+    if precision is None:
+        return "1"
+    if precision_mode == TICK_SIZE:
+        return number_to_string(precision)
+    if precision_mode == DECIMAL_PLACES:
+        return number_to_string(10 ** -int(precision))
+    raise ValueError(f"Unsupported ccxt precision mode {precision_mode}")
+
+
+def _is_tradable(market):
+    info = market["info"]
+    return ("status" in info and info["status"] == "TRADING") and market["type"] == "spot" \
+        and market["quote"] == QUOTE_CURRENCY
+
+
+# Active markets for the quote currency, reloaded after a TTL and kept on disk between runs
+class MarketCache:
+    def __init__(self, path=MARKET_CACHE_PATH, ttl=MARKET_CACHE_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self.exchange = None
+        self.markets = {}
+        self.loaded_at = 0.0
+        self.lock = asyncio.Lock()
+
+    def is_fresh(self, exchange):
+        return bool(self.markets) and self.exchange == exchange and time.time() - self.loaded_at < self.ttl
+
+    def load(self, exchange):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        # A file written for another exchange, such as the mock, is stale
+        if saved.get("exchange") != exchange:
+            return False
+        self.exchange = exchange
+        self.loaded_at = saved["loaded_at"]
+        self.markets = {symbol: MarketInfo(symbol, *row) for symbol, row in saved["markets"].items()}
+        return True
+
+    def save(self):
+        saved = {"exchange": self.exchange, "loaded_at": self.loaded_at,
+                 "markets": {symbol: info.to_row() for symbol, info in self.markets.items()}}
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(saved, f, separators=(",", ":"))
+        os.replace(self.path + ".tmp", self.path)
+
+    async def refresh(self, client):
+        markets = await client.load_markets(reload=True)
+        self.exchange = client.id
+        precision_mode = getattr(client, "precisionMode", TICK_SIZE)
+        self.markets = {symbol: MarketInfo.from_ccxt(market, precision_mode)
+                        for symbol, market in markets.items() if _is_tradable(market)}
+        self.loaded_at = time.time()
+        self.save()
+
+    async def ensure(self, client):
+        """
+            Makes the cache current: memory first, then the file on disk, then the exchange.
+            Concurrent callers share a single reload.
+        """
+        if self.is_fresh(client.id):
+            return self
+        async with self.lock:
+            if not self.is_fresh(client.id) and not (self.load(client.id) and self.is_fresh(client.id)):
+                await self.refresh(client)
+        return self
+
+    def get(self, symbol):
+        return self.markets[symbol]
+
+    def symbols(self):
+        return list(self.markets)
+
+
+_market_cache = MarketCache()
+
+
+# Get the shared market cache, reloading it if stale
+async def get_market_cache(client):
+    return await _market_cache.ensure(client)
@@ -0,0 +1,175 @@
+import asyncio
+import contextlib
+import functools
+import os
+import time
+
+from constants import METRICS_ENABLED, METRICS_PATH
+
+# Values for the current run keyed by (name, labels)
+_counters = {}
+_gauges = {}
+_timings = {}
+
+# Returned by span() and stage() when metrics are off, so the with block costs one flag check
+_NO_SPAN = contextlib.nullcontext()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+# Add to a counter
+def count(name, value=1, **labels):
+    if METRICS_ENABLED:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    if METRICS_ENABLED:
+        _gauges[_key(name, labels)] = value
+
+
+# Record one timing as count, sum and max
+def observe(name, seconds, **labels):
+    if METRICS_ENABLED:
+        timing = _timings.setdefault(_key(name, labels), [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+
+
+class _Span:
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+# Time a block of code, sync or async
+def span(name, **labels):
+    return _Span(name, labels) if METRICS_ENABLED else _NO_SPAN
+
+
+class _Stage(_Span):
+    __slots__ = ()
+
+    def __enter__(self):
+        set_gauge("bot_stage_running", 1, **self.labels)
+        set_gauge("bot_stage_started_timestamp_seconds", time.time(), **self.labels)
+        write_metrics()
+        return super().__enter__()
+
+    def __exit__(self, *exc_info):
+        super().__exit__(*exc_info)
+        set_gauge("bot_stage_running", 0, **self.labels)
+        write_metrics()
+        return False
+
+
+# Time a top-level stage of a run
+def stage(name):
+    """
+        The metrics file is written when the stage starts and ends, so a run killed part way
+        leaves bot_stage_running set for the stage it was in.
+    """
+    return _Stage("bot_stage_seconds", {"stage": name}) if METRICS_ENABLED else _NO_SPAN
+
+
+# Decorator timing every call of a function or coroutine function
+def timed(name, **labels):
+    """
+        Leaves the function untouched when metrics are off.
+    """
+    def decorate(func):
+        if not METRICS_ENABLED:
+            return func
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with _Span(name, labels):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with _Span(name, labels):
+                    return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# Forwards to a ccxt client, timing every request and counting failures by method
+class InstrumentedClient:
+    def __init__(self, client):
+        object.__setattr__(self, "_client", client)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        # Stream watches block until data arrives, so their duration says nothing about the exchange
+        if name.startswith("watch") or not asyncio.iscoroutinefunction(attribute):
+            return attribute
+
+        async def request(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await attribute(*args, **kwargs)
+            except Exception as e:
+                count("bot_exchange_errors_total", method=name, error=type(e).__name__)
+                raise
+            finally:
+                observe("bot_exchange_request_seconds", time.perf_counter() - started, method=name)
+        return request
+
+    def __setattr__(self, name, value):
+        setattr(self._client, name, value)
+
+
+def instrument_client(client):
+    return InstrumentedClient(client) if METRICS_ENABLED else client
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+# Current values in the Prometheus text exposition format
+def render():
+    lines = []
+    for kind, values in (("counter", _counters), ("gauge", _gauges)):
+        for name in sorted({name for name, _ in values}):
+            lines.append(f"# TYPE {name} {kind}")
+            lines += [f"{name}{_format_labels(labels)} {value}"
+                      for (key_name, labels), value in sorted(values.items()) if key_name == name]
+    for name in sorted({name for name, _ in _timings}):
+        lines.append(f"# TYPE {name} summary")
+        for (key_name, labels), (calls, total, longest) in sorted(_timings.items()):
+            if key_name == name:
+                lines.append(f"{name}_count{_format_labels(labels)} {calls}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"# TYPE {name}_max gauge")
+        lines += [f"{name}_max{_format_labels(labels)} {longest}"
+                  for (key_name, labels), (_, _, longest) in sorted(_timings.items()) if key_name == name]
+    return "\n".join(lines) + "\n"
+
+
+# Write the metrics file, replacing it atomically so a scraper never reads half of it
+def write_metrics(path=METRICS_PATH):
+    if not METRICS_ENABLED:
+        return
+    set_gauge("bot_metrics_written_timestamp_seconds", time.time())
+    with open(path + ".tmp", "w") as f:
+        f.write(render())
+    os.replace(path + ".tmp", path)
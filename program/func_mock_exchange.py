@@ -0,0 +1,231 @@
+import asyncio
+import bisect
+import heapq
+import itertools
+import time
+from collections import defaultdict
+
+import ccxt.async_support as ccxt
+from ccxt.base.decimal_to_precision import TICK_SIZE
+
+from constants import RESOLUTION, HISTORY_BARS, QUOTE_CURRENCY, MOCK_CLOCK_SPEED, MOCK_START_TIME, \
+    MOCK_FILL_LATENCY_SECONDS, MOCK_SLIPPAGE, MOCK_STARTING_BALANCE, MOCK_DATABASE_PATH, FIND_COINTEGRATED
+from func_database import backup_database, use_database, get_candle_markets, get_candles, delete_candles_after, \
+    clear_pair_state
+from func_stream import ReplayFinished
+from func_utils import set_clock
+
+# Price and amount increment of every mock market
+MOCK_PRECISION = 1e-8
+
+
+# Clock that starts at a chosen time and runs faster than real time
+class SimulatedClock:
+    def __init__(self, start, speed=MOCK_CLOCK_SPEED):
+        self.start = start
+        self.speed = speed
+        self.started = time.monotonic()
+
+    def time(self):
+        return self.start + (time.monotonic() - self.started) * self.speed
+
+    def to_wall_seconds(self, seconds):
+        return seconds / self.speed
+
+
+# In-process stand-in for an async ccxt client, trading stored candles on a simulated clock
+class MockExchange:
+    """
+        Serves the ccxt methods the bot calls. fetch_ohlcv and watch_ohlcv only return bars that have
+        closed on the clock. Market orders stay open for fill_latency simulated seconds, then fill at
+        the last close before the fill moved by slippage against the order. Balances may go negative,
+        so the short leg of a pair can be sold without holding it.
+    """
+    id = "mock"
+    precisionMode = TICK_SIZE
+    has = {"fetchOHLCV": True, "fetchOrders": True, "watchOHLCV": True, "watchOHLCVForSymbols": False}
+
+    def __init__(self, clock, candles_by_market, balance=MOCK_STARTING_BALANCE,
+                 fill_latency=MOCK_FILL_LATENCY_SECONDS, slippage=MOCK_SLIPPAGE, resolution=RESOLUTION):
+        self.clock = clock
+        self.resolution = resolution
+        self.timeframe_ms = ccxt.Exchange.parse_timeframe(resolution) * 1000
+        self.fill_latency = fill_latency
+        self.slippage = slippage
+        self.rateLimit = 0
+        self.options = {}
+        self.candles = {market: rows for market, rows in candles_by_market.items() if rows}
+        self.timestamps = {market: [row[0] for row in rows] for market, rows in self.candles.items()}
+        self.end = max(timestamps[-1] for timestamps in self.timestamps.values()) + self.timeframe_ms
+        self.balances = defaultdict(float, {QUOTE_CURRENCY: float(balance)})
+        self.orders = {}
+        self.fills = []
+        self.order_ids = itertools.count(1)
+        self.watched = {}
+        self.markets = {}
+
+    def now_ms(self):
+        return int(self.clock.time() * 1000)
+
+    def seconds_remaining(self):
+        return max(self.end - self.now_ms(), 0) / 1000
+
+    def _market_candles(self, symbol):
+        if symbol not in self.candles:
+            raise ccxt.BadSymbol(f"mock does not have market symbol {symbol}")
+        return self.candles[symbol]
+
+    def _closed_bars(self, symbol, at_ms):
+        # Bars opening at or before at_ms - timeframe have closed
+        return bisect.bisect_right(self.timestamps[symbol], at_ms - self.timeframe_ms)
+
+    def _settle(self):
+        now_ms = self.now_ms()
+        while self.fills and self.fills[0][0] <= now_ms:
+            fill_ms, order_id = heapq.heappop(self.fills)
+            order = self.orders[order_id]
+            if order["status"] != "open":
+                continue
+            closed = self._closed_bars(order["symbol"], fill_ms)
+            if not closed:
+                order["status"] = "rejected"
+                continue
+            direction = 1 if order["side"] == "buy" else -1
+            price = self.candles[order["symbol"]][closed - 1][4] * (1 + direction * self.slippage)
+            base, quote = order["symbol"].split("/")
+            self.balances[base] += direction * order["amount"]
+            self.balances[quote] -= direction * order["amount"] * price
+            order.update(status="closed", filled=order["amount"], remaining=0.0, price=price, average=price,
+                         cost=order["amount"] * price, lastTradeTimestamp=fill_ms)
+
+    async def load_markets(self, reload=False, params={}):
+        if not self.markets or reload:
+            self.markets = {}
+            for symbol in self.candles:
+                base, quote = symbol.split("/")
+                self.markets[symbol] = {
+                    "id": symbol.replace("/", ""), "symbol": symbol, "base": base, "quote": quote,
+                    "type": "spot", "spot": True, "active": True,
+                    "precision": {"price": MOCK_PRECISION, "amount": MOCK_PRECISION},
+                    "limits": {"amount": {"min": MOCK_PRECISION}, "cost": {"min": 0.0}},
+                    "info": {"status": "TRADING"},
+                }
+        return self.markets
+
+    async def fetch_ohlcv(self, symbol, timeframe="1m", since=None, limit=None, params={}):
+        if timeframe != self.resolution:
+            raise ccxt.NotSupported(f"mock only serves {self.resolution} candles")
+        rows = self._market_candles(symbol)
+        end = self._closed_bars(symbol, self.now_ms())
+        if since is None:
+            start = max(end - (limit or 500), 0)
+        else:
+            start = bisect.bisect_left(self.timestamps[symbol], since)
+        if limit:
+            end = min(end, start + limit)
+        return [list(row) for row in rows[start:end]]
+
+    async def watch_ohlcv(self, symbol, timeframe=RESOLUTION, since=None, limit=None, params={}):
+        rows = self._market_candles(symbol)
+        following = self.watched.setdefault(symbol, self._closed_bars(symbol, self.now_ms()))
+        if following >= len(rows):
+            raise ReplayFinished(symbol)
+        close_ms = rows[following][0] + self.timeframe_ms
+        await asyncio.sleep(self.clock.to_wall_seconds(max(close_ms - self.now_ms(), 0) / 1000))
+        self.watched[symbol] = following + 1
+        return [list(rows[following])]
+
+    async def create_order(self, symbol, type, side, amount, price=None, params={}):
+        self._market_candles(symbol)
+        if type != "market":
+            raise ccxt.NotSupported("mock only fills market orders")
+        now_ms = self.now_ms()
+        order_id = str(next(self.order_ids))
+        self.orders[order_id] = {
+            "id": order_id, "clientOrderId": None, "timestamp": now_ms, "datetime": ccxt.Exchange.iso8601(now_ms),
+            "lastTradeTimestamp": None, "symbol": symbol, "type": type, "side": side, "amount": float(amount),
+            "filled": 0.0, "remaining": float(amount), "price": None, "average": None, "cost": 0.0,
+            "status": "open", "fee": None, "trades": [],
+        }
+        heapq.heappush(self.fills, (now_ms + int(self.fill_latency * 1000), order_id))
+        return dict(self.orders[order_id])
+
+    async def fetch_order(self, id, symbol=None, params={}):
+        self._settle()
+        if id not in self.orders:
+            raise ccxt.OrderNotFound(f"mock order {id} not found")
+        return dict(self.orders[id])
+
+    async def fetch_orders(self, symbol=None, since=None, limit=None, params={}):
+        self._settle()
+        return [dict(order) for order in self.orders.values() if symbol is None or order["symbol"] == symbol]
+
+    async def fetch_open_orders(self, symbol=None, since=None, limit=None, params={}):
+        return [order for order in await self.fetch_orders(symbol) if order["status"] == "open"]
+
+    async def cancel_order(self, id, symbol=None, params={}):
+        self._settle()
+        order = self.orders.get(id)
+        if order is None or order["status"] != "open":
+            raise ccxt.OrderNotFound(f"mock order {id} is not open")
+        order["status"] = "canceled"
+        return dict(order)
+
+    async def cancel_all_orders(self, symbol=None, params={}):
+        return [await self.cancel_order(order["id"]) for order in await self.fetch_open_orders(symbol)]
+
+    async def fetch_balance(self, params={}):
+        self._settle()
+        balance = {"free": dict(self.balances), "used": {code: 0.0 for code in self.balances},
+                   "total": dict(self.balances)}
+        for code, amount in self.balances.items():
+            balance[code] = {"free": amount, "used": 0.0, "total": amount}
+        return balance
+
+    def set_sandbox_mode(self, enabled):
+        return
+
+    async def close(self):
+        return
+
+    def summary(self):
+        self._settle()
+        statuses = defaultdict(int)
+        for order in self.orders.values():
+            statuses[order["status"]] += 1
+        return {"time": ccxt.Exchange.iso8601(self.now_ms()), "orders": len(self.orders), **statuses,
+                QUOTE_CURRENCY: self.balances[QUOTE_CURRENCY]}
+
+
+_mock_exchange = None
+
+
+# Build the mock exchange over a copy of the stored candles and install its clock
+def create_mock_exchange(start=MOCK_START_TIME, db_path=MOCK_DATABASE_PATH):
+    """
+        The bot is switched to a copy of the database holding only the bars closed before start,
+        so the store fills up through fetch_ohlcv as the clock advances, just as it would live.
+        Pairs and positions in the copy are cleared, as they were found on bars after start and
+        reference orders the mock never placed.
+    """
+    global _mock_exchange
+    backup_database(db_path)
+    use_database(db_path)
+    candles = {market: get_candles(market, RESOLUTION) for market in get_candle_markets(RESOLUTION)}
+    if not candles:
+        raise ValueError(f"No {RESOLUTION} candles stored to replay")
+    timeframe_ms = ccxt.Exchange.parse_timeframe(RESOLUTION) * 1000
+    if start is None:
+        start = min(rows[0][0] for rows in candles.values()) + HISTORY_BARS * timeframe_ms
+    delete_candles_after(RESOLUTION, start - timeframe_ms)
+    clear_pair_state()
+    if not FIND_COINTEGRATED:
+        print("Warning: FIND_COINTEGRATED is off, so the replay has no cointegrated pairs to trade")
+    clock = SimulatedClock(start / 1000)
+    set_clock(clock)
+    _mock_exchange = MockExchange(clock, candles)
+    return _mock_exchange
+
+
+def get_mock_exchange():
+    return _mock_exchange
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from func_database import get_cointegrated_markets, get_table_version
+
+
+# Cointegrated pairs held as NumPy columns with integer market codes
+class PairRegistry:
+    """
+        first and second are codes into markets, so per-market tests become a lookup into an array
+        indexed by code. The table is only re-read when its version counter has moved.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.markets = np.array([], dtype=object)
+        self.market_codes = {}
+        self.first = np.array([], dtype=np.int32)
+        self.second = np.array([], dtype=np.int32)
+        self.hedge_ratio = np.array([], dtype=np.float64)
+        self.half_life = np.array([], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.first)
+
+    def load(self, pairs):
+        codes, markets = pd.factorize(pd.concat([pairs["first_market"], pairs["second_market"]], ignore_index=True))
+        self.markets = np.asarray(markets, dtype=object)
+        self.market_codes = {market: code for code, market in enumerate(self.markets)}
+        self.first = codes[:len(pairs)].astype(np.int32)
+        self.second = codes[len(pairs):].astype(np.int32)
+        self.hedge_ratio = pairs["hedge_ratio"].to_numpy(dtype=np.float64)
+        self.half_life = pairs["half_life"].to_numpy(dtype=np.float64)
+
+    def refresh(self):
+        # Read the version first: a write landing between the two reads only causes one extra reload
+        version = get_table_version("cointegrated_pairs")
+        if version is None or version != self.version:
+            self.load(get_cointegrated_markets())
+            self.version = version
+        return self
+
+    def market_mask(self, markets):
+        """
+            Boolean array over market codes, True for codes whose market is in markets.
+        """
+        return np.array([market in markets for market in self.markets], dtype=bool)
+
+    def pair_mask(self, market_mask):
+        return market_mask[self.first] & market_mask[self.second]
+
+
+_pair_registry = PairRegistry()
+
+
+# Get the shared registry, reloading it if the pairs table changed
+def get_pair_registry():
+    return _pair_registry.refresh()
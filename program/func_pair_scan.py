@@ -0,0 +1,223 @@
+import os
+import time
+from concurrent.futures import as_completed
+
+import numpy as np
+import pandas as pd
+
+from constants import MAX_HALF_LIFE, COINTEGRATION_WORKERS, COINTEGRATION_CHUNK_SIZE, PRESCREEN_ENABLED, \
+    PRESCREEN_ON_RETURNS, PRESCREEN_MIN_CORRELATION, PRESCREEN_TOP_K, PRESCREEN_VARIANCE_RATIO, \
+    PRESCREEN_VARIANCE_RATIO_LAG, PRESCREEN_MAX_HALF_LIFE, COINTEGRATION_RETEST_BARS, COINTEGRATION_MAX_AGE_HOURS, \
+    COINTEGRATION_MAX_RETESTS
+from func_cointegration import calculate_cointegration_batch, half_life_mean_reversion_batch
+from func_database import get_pair_tests, upsert_pair_tests, get_cointegrated_markets, upsert_cointegrated_markets
+from func_metrics import count, span
+from func_worker_pool import attached_prices, price_worker_pool
+
+
+# Test one shard of pairs against the attached price matrix
+def _test_pairs(first_index, second_indices):
+    prices = attached_prices()
+    series_1 = np.asarray(prices[:, first_index])
+    block = np.asarray(prices[:, second_indices])
+    cointegration_flags, hedge_ratios, intercepts, _, _ = calculate_cointegration_batch(series_1, block)
+
+    passed = []
+    cointegrated = np.flatnonzero(cointegration_flags)
+    spreads = series_1[:, None] - block[:, cointegrated] * hedge_ratios[cointegrated] - intercepts[cointegrated]
+    half_lives = half_life_mean_reversion_batch(spreads)
+    for k, half_life in zip(cointegrated, half_lives):
+        if MAX_HALF_LIFE >= half_life > 0:
+            passed.append((int(first_index), int(second_indices[k]), hedge_ratios[k], half_life))
+    return len(second_indices), passed
+
+
+# Split candidate pairs into shards sharing a first market
+def pair_chunks(first_indices, second_indices, chunk_size=COINTEGRATION_CHUNK_SIZE):
+    order = np.lexsort((second_indices, first_indices))
+    first_indices, second_indices = first_indices[order], second_indices[order]
+    bases, starts = np.unique(first_indices, return_index=True)
+    ends = np.append(starts[1:], len(first_indices))
+    for first_index, start, end in zip(bases, starts, ends):
+        for chunk_start in range(start, end, chunk_size):
+            yield int(first_index), second_indices[chunk_start:min(chunk_start + chunk_size, end)]
+
+
+# Cheap filters that discard obviously unrelated pairs before the cointegration test
+def prescreen_pairs(prices):
+    """
+        Returns the candidate (first indices, second indices) and the number of pairs each stage dropped.
+        Correlation of log prices (or log returns) comes from one matrix product over all markets.
+        Variance-ratio and half-life bounds are checked on the price spread at the OLS hedge ratio.
+    """
+    n_markets = prices.shape[1]
+    first_indices, second_indices = np.triu_indices(n_markets, k=1)
+    stage_counts = {"pairs": len(first_indices)}
+    if not PRESCREEN_ENABLED:
+        stage_counts["remaining"] = len(first_indices)
+        return first_indices, second_indices, stage_counts
+
+    def apply(stage, keep):
+        nonlocal first_indices, second_indices
+        stage_counts[stage] = int(len(keep) - np.count_nonzero(keep))
+        first_indices, second_indices = first_indices[keep], second_indices[keep]
+
+    # Correlation stage
+    data = np.log(prices)
+    if PRESCREEN_ON_RETURNS:
+        data = np.diff(data, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlation = np.abs(np.corrcoef(data, rowvar=False))
+    pair_correlation = correlation[first_indices, second_indices]
+    apply("correlation", pair_correlation >= PRESCREEN_MIN_CORRELATION)
+
+    if PRESCREEN_TOP_K is not None and len(first_indices) > PRESCREEN_TOP_K:
+        pair_correlation = correlation[first_indices, second_indices]
+        keep = np.zeros(len(first_indices), dtype=bool)
+        keep[np.argpartition(-pair_correlation, PRESCREEN_TOP_K - 1)[:PRESCREEN_TOP_K]] = True
+        apply("top_k", keep)
+
+    # Spread stages, in blocks so the spread matrix stays small
+    if PRESCREEN_VARIANCE_RATIO is not None or PRESCREEN_MAX_HALF_LIFE is not None:
+        covariance = np.cov(prices, rowvar=False)
+        variance_ratios = np.empty(len(first_indices))
+        half_lives = np.empty(len(first_indices))
+        for start in range(0, len(first_indices), 4096):
+            first, second = first_indices[start:start + 4096], second_indices[start:start + 4096]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                hedge_ratios = covariance[first, second] / covariance[second, second]
+                spreads = prices[:, first] - prices[:, second] * hedge_ratios
+                variance_ratios[start:start + 4096] = _variance_ratios(spreads, PRESCREEN_VARIANCE_RATIO_LAG)
+                half_lives[start:start + 4096] = half_life_mean_reversion_batch(spreads)
+        if PRESCREEN_VARIANCE_RATIO is not None:
+            low, high = PRESCREEN_VARIANCE_RATIO
+            keep = (variance_ratios >= low) & (variance_ratios <= high)
+            half_lives = half_lives[keep]
+            apply("variance_ratio", keep)
+        if PRESCREEN_MAX_HALF_LIFE is not None:
+            apply("half_life", (half_lives > 0) & (half_lives <= PRESCREEN_MAX_HALF_LIFE))
+
+    stage_counts["remaining"] = len(first_indices)
+    return first_indices, second_indices, stage_counts
+
+
+# Lo-MacKinlay variance ratio of each spread column, below 1 when mean reverting
+def _variance_ratios(spreads, lag):
+    return np.var(spreads[lag:] - spreads[:-lag], axis=0) / (lag * np.var(np.diff(spreads, axis=0), axis=0))
+
+
+# Scan pairs over a process pool, yielding passing pairs as shards finish
+def scan_pairs(prices, pairs=None, workers=COINTEGRATION_WORKERS, chunk_size=COINTEGRATION_CHUNK_SIZE,
+               progress_every=5.0):
+    """
+        prices: float64 matrix with one column per market
+        pairs: (first indices, second indices) to test, every pair when None
+        Shards run on a price_worker_pool, so workers memory-map the matrix rather than receiving pickled series.
+        Yields (first index, second index, hedge ratio, half life) for each pair meeting the criteria.
+    """
+    first_indices, second_indices = pairs if pairs is not None else np.triu_indices(prices.shape[1], k=1)
+    total = len(first_indices)
+    workers = workers or os.cpu_count() or 1
+    tested = 0
+    started = last_report = time.monotonic()
+
+    def report_progress(final=False):
+        elapsed = time.monotonic() - started
+        rate = tested / elapsed if elapsed > 0 else 0.0
+        label = "Tested" if final else "Testing"
+        if final:
+            count("bot_pairs_tested_total", tested)
+        print(f"{label} {tested}/{total} pairs in {elapsed:.1f}s ({rate:.0f} pairs/s)")
+
+    with price_worker_pool(prices, workers) as executor:
+        futures = [executor.submit(_test_pairs, first_index, shard)
+                   for first_index, shard in pair_chunks(first_indices, second_indices, chunk_size)]
+        for future in as_completed(futures):
+            shard_tested, passed = future.result()
+            tested += shard_tested
+            yield from passed
+            if time.monotonic() - last_report >= progress_every:
+                last_report = time.monotonic()
+                report_progress()
+    report_progress(final=True)
+
+
+def _prescreen_with_report(prices):
+    with span("bot_prescreen_seconds"):
+        first_indices, second_indices, stage_counts = prescreen_pairs(prices)
+    count("bot_pairs_prescreened_total", stage_counts["pairs"])
+    dropped = ", ".join(f"{stage} -{count}" for stage, count in stage_counts.items()
+                        if stage not in ("pairs", "remaining"))
+    print(f"Pre-screen kept {stage_counts['remaining']}/{stage_counts['pairs']} pairs ({dropped or 'disabled'})")
+    return first_indices, second_indices
+
+
+# Store Cointegration Results
+def find_cointegrated_markets_from_all_markets(df_market_prices, workers=COINTEGRATION_WORKERS):
+    markets = df_market_prices.columns.to_list()
+    prices = df_market_prices.to_numpy(dtype=np.float64)
+
+    first_indices, second_indices = _prescreen_with_report(prices)
+    criteria_met_pairs = sorted(scan_pairs(prices, (first_indices, second_indices), workers=workers))
+    df_criteria_met = pd.DataFrame(
+        [(markets[i], markets[j], hedge_ratio, half_life) for i, j, hedge_ratio, half_life in criteria_met_pairs],
+        columns=["first_market", "second_market", "hedge_ratio", "half_life"],
+    )
+    return df_criteria_met
+
+
+# Re-test only pairs that are new, have enough new bars or are too old, and upsert the results
+def refresh_cointegrated_markets(df_market_prices, workers=COINTEGRATION_WORKERS):
+    """
+        Results for every tested pair are kept in pair_test with the data range they were computed on.
+        Pairs never tested come first, then the oldest, up to COINTEGRATION_MAX_RETESTS per run.
+        Pairs dropped by the pre-screen or whose markets are gone are removed from cointegrated_pairs.
+        Returns the stored cointegrated pairs after the refresh.
+    """
+    markets = df_market_prices.columns.to_list()
+    prices = df_market_prices.to_numpy(dtype=np.float64)
+    timestamps = df_market_prices.index.to_numpy(dtype=np.int64)
+    data_start, data_end = int(timestamps[0]), int(timestamps[-1])
+    bar_ms = int(np.median(np.diff(timestamps))) if len(timestamps) > 1 else 1
+
+    first_indices, second_indices = _prescreen_with_report(prices)
+    candidates = pd.DataFrame({
+        "first_index": first_indices,
+        "second_index": second_indices,
+        "first_market": np.array(markets, dtype=object)[first_indices],
+        "second_market": np.array(markets, dtype=object)[second_indices],
+    })
+    candidates = candidates.merge(get_pair_tests(), on=["first_market", "second_market"], how="left")
+
+    new_bars = (data_end - candidates["data_end"]) // bar_ms
+    never_tested = candidates["data_end"].isna()
+    stale = never_tested | (new_bars >= COINTEGRATION_RETEST_BARS) | (
+            candidates["age_hours"] >= COINTEGRATION_MAX_AGE_HOURS)
+    retest = candidates[stale].assign(never_tested=never_tested[stale]).sort_values(
+        ["never_tested", "age_hours"], ascending=[False, False])
+    if COINTEGRATION_MAX_RETESTS is not None:
+        retest = retest.head(COINTEGRATION_MAX_RETESTS)
+    print(f"Incremental refresh: {len(retest)} of {len(candidates)} candidate pairs need testing "
+          f"({int(never_tested.sum())} never tested)")
+
+    passed = {(i, j): (hedge_ratio, half_life) for i, j, hedge_ratio, half_life in scan_pairs(
+        prices, (retest["first_index"].to_numpy(), retest["second_index"].to_numpy()), workers=workers)}
+    results = [passed.get((i, j), (np.nan, np.nan))
+               for i, j in zip(retest["first_index"], retest["second_index"])]
+    tests = retest[["first_market", "second_market"]].assign(
+        cointegrated=[int((i, j) in passed) for i, j in zip(retest["first_index"], retest["second_index"])],
+        hedge_ratio=[hedge_ratio for hedge_ratio, _ in results],
+        half_life=[half_life for _, half_life in results],
+        data_start=data_start,
+        data_end=data_end,
+    )
+    upsert_pair_tests(tests)
+
+    # Drop pairs that failed their re-test or no longer make it into the candidate set
+    candidate_keys = set(zip(candidates["first_market"], candidates["second_market"]))
+    failed = tests[tests["cointegrated"] == 0]
+    removed_pairs = list(zip(failed["first_market"], failed["second_market"]))
+    stored = get_cointegrated_markets()
+    removed_pairs += [key for key in zip(stored["first_market"], stored["second_market"]) if key not in candidate_keys]
+    upsert_cointegrated_markets(tests[tests["cointegrated"] == 1], removed_pairs)
+    return get_cointegrated_markets()
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+
+# Close prices for many markets on one shared timestamp index
+class PriceMatrix:
+    """
+        timestamps: sorted int64 candle open times (ms), one per row
+        markets: market symbols, one per column
+        values: float64 matrix of close prices, column-major so each market series is contiguous
+    """
+
+    def __init__(self, timestamps, markets, values):
+        self.timestamps = timestamps
+        self.markets = list(markets)
+        self.values = values
+        self.column = {market: i for i, market in enumerate(self.markets)}
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def series(self, market):
+        return self.values[:, self.column[market]]
+
+    def drop_incomplete(self):
+        # Keep only markets with a price on every timestamp
+        complete = ~np.isnan(self.values).any(axis=0)
+        if complete.all():
+            return self
+        markets = [m for m, keep in zip(self.markets, complete) if keep]
+        return PriceMatrix(self.timestamps, markets, np.asfortranarray(self.values[:, complete]))
+
+    def drop_incomplete_tail(self):
+        # Cut the rows after the last timestamp every market has a price for, e.g. bars that closed
+        # between the fetches of two markets, so the newest row is complete
+        complete = np.flatnonzero(~np.isnan(self.values).any(axis=1))
+        end = complete[-1] + 1 if len(complete) else 0
+        if end == len(self.timestamps):
+            return self
+        return PriceMatrix(self.timestamps[:end], self.markets, np.asfortranarray(self.values[:end]))
+
+    def to_frame(self):
+        index = pd.Index(self.timestamps, name="datetime")
+        return pd.DataFrame(self.values, index=index, columns=self.markets, copy=False)
+
+
+# Convert raw ccxt candles into (timestamps, closes) arrays
+def ohlcv_to_arrays(candles):
+    if len(candles) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    ohlcv = np.asarray(candles, dtype=np.float64)
+    return ohlcv[:, 0].astype(np.int64), ohlcv[:, 4]
+
+
+# Align every market onto the union of timestamps in a single pass
+def build_price_matrix(series_by_market):
+    """
+        series_by_market: dict of market -> (timestamps, closes)
+        Timestamps missing for a market are left as NaN, matching an outer merge.
+    """
+    markets = [m for m, (ts, _) in series_by_market.items() if len(ts) > 0]
+    if not markets:
+        return PriceMatrix(np.empty(0, dtype=np.int64), [], np.empty((0, 0), dtype=np.float64, order="F"))
+
+    timestamps = np.unique(np.concatenate([series_by_market[m][0] for m in markets]))
+    values = np.full((len(timestamps), len(markets)), np.nan, dtype=np.float64, order="F")
+    for j, market in enumerate(markets):
+        ts, closes = series_by_market[market]
+        values[np.searchsorted(timestamps, ts), j] = closes
+    return PriceMatrix(timestamps, markets, values)
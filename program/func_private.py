@@ -1,49 +1,188 @@
 # Cancel Order
+import asyncio
 from pprint import pprint
 
+import ccxt.async_support as ccxt
+
+from constants import ORDER_POLL_INITIAL_SECONDS, ORDER_POLL_BACKOFF, ORDER_POLL_MAX_SECONDS, \
+  ORDER_FILL_TIMEOUT_SECONDS, QUOTE_CURRENCY
 from func_connections import close_client
+from func_database import is_market_in_live_pair, get_live_pair_positions, close_pair_positions
+from func_downloader import download_markets
+from func_utils import clock_time, clock_sleep
 
 
-async def cancel_order(client, order_id):
-  pass
+async def cancel_order(client, order_id, market=None):
+  return await client.cancel_order(order_id, market)
 # Get Account
 async def get_account(client):
-  pass
+  balances = await client.fetch_balance()
+  return {"freeCollateral": balances["free"].get(QUOTE_CURRENCY, 0)}
 
 # Get Balances
 async def get_balances(client):
   balances = await client.fetch_balance()
   return balances
-# Get Open Positions
+# Get Open Positions - the pairs the bot opened and has not closed
 async def get_open_positions(client):
-  pass
+  return get_live_pair_positions()
 
 
 # Get Existing Order
-async def get_order(client, order_id):
-  pass
+async def get_order(client, order_id, market=None):
+  return await client.fetch_order(order_id, market)
+
+
+# Order fields used to reconcile saved positions
+def _order_record(order):
+  return {"id": order["id"], "ticker": order["symbol"], "size": order["amount"], "side": order["side"].upper(),
+          "status": order["status"]}
+
+
+# Snapshot of orders and balances for reconciling many saved positions at once
+class ExchangeSnapshot:
+
+  """
+    Orders indexed by id, and the markets where a base asset balance is held
+  """
+
+  def __init__(self, orders, markets_live):
+    self.orders_by_id = {order["id"]: order for order in orders}
+    self.markets_live = markets_live
+
+  def get_order(self, order_id):
+    return self.orders_by_id.get(order_id)
+
+
+async def _fetch_market_orders(client, market):
+  return await client.fetch_orders(market)
+
+
+# Look up one order, None if the exchange does not know it
+async def _find_order(client, order_id, market):
+  try:
+    return _order_record(await get_order(client, order_id, market))
+  except ccxt.OrderNotFound:
+    return None
+
+
+# Pull orders and balances for many markets in as few calls as possible
+async def get_exchange_snapshot(client, markets, orders=()):
+
+  """
+    One fetch_balance plus one fetch_orders per market, run concurrently under the shared
+    rate limiter. Any of the (order_id, market) pairs in orders not returned by the bulk calls
+    is looked up on its own.
+  """
+
+  markets = sorted(set(markets))
+  balance, (orders_by_market, report) = await asyncio.gather(
+    client.fetch_balance(),
+    download_markets(client, markets, _fetch_market_orders),
+  )
+  if report.failures:
+    print(report.summary())
+  records = [_order_record(order) for market_orders in orders_by_market.values() for order in market_orders]
+
+  # Fall back to single lookups for anything the bulk calls missed
+  known = {order["id"] for order in records}
+  missing = {order_id: market for order_id, market in orders if order_id and order_id not in known}
+  if missing:
+    found = await asyncio.gather(*[_find_order(client, order_id, market) for order_id, market in missing.items()])
+    records += [order for order in found if order]
+
+  totals = balance.get("total", {})
+  markets_live = {market for market in markets if totals.get(market.split("/")[0], 0) != 0}
+  return ExchangeSnapshot(records, markets_live)
 
 
 # Get existing open positions
 async def is_open_positions(client, market):
-  return False
+  return is_market_in_live_pair(market)
+
+
+# ccxt order statuses mapped to the statuses the agents act on
+ORDER_STATUSES = {"closed": "FILLED", "canceled": "CANCELED", "expired": "CANCELED", "rejected": "CANCELED"}
 
 
 # Check order status
-async def check_order_status(client, order_id):
-  return "FAILED"
+async def check_order_status(client, order_id, market=None):
+  order = await client.fetch_order(order_id, market)
+  return ORDER_STATUSES.get(order["status"], "OPEN")
+
+
+# Wait for an order to reach a final status without blocking the event loop
+async def wait_for_order_status(client, order_id, market=None, final_statuses=("FILLED", "CANCELED", "FAILED"),
+                                timeout=ORDER_FILL_TIMEOUT_SECONDS):
+
+  """
+    Poll check_order_status with exponential backoff until the status is one of final_statuses
+    or timeout seconds have passed. Returns the last status seen.
+  """
+
+  deadline = clock_time() + timeout
+  delay = ORDER_POLL_INITIAL_SECONDS
+  while True:
+    await clock_sleep(min(delay, max(deadline - clock_time(), 0)))
+    order_status = await check_order_status(client, order_id, market)
+    if order_status in final_statuses or clock_time() >= deadline:
+      return order_status
+    delay = min(delay * ORDER_POLL_BACKOFF, ORDER_POLL_MAX_SECONDS)
 
 
 # Place market order
 async def place_market_order(client, market, side, size, price, reduce_only):
   client.options["createMarketBuyOrderRequiresPrice"] = False
-  if side == "BUY":
-    order = await client.create_market_buy_order(market, size)
+  order = await client.create_order(market, "market", side.lower(), float(size))
+  return order, order["id"]
 
 # Get Open Orders
 async def cancel_all_orders(client, symbol):
   await client.cancel_all_orders(symbol=symbol)
 
+# Close one recorded leg with a market order and wait for it to fill
+async def _close_leg(client, market, side, size):
+  close_side = "BUY" if side == "SELL" else "SELL"
+  _, order_id = await place_market_order(client, market, close_side, size, None, reduce_only=True)
+  return await wait_for_order_status(client, order_id, market)
+
+
 # Abort all open positions
 async def abort_all_positions(client):
-  pass
+
+  """
+    Only the legs recorded in LIVE pair_position rows are traded, so holdings the bot did not open
+    are left alone. A pair is marked closed once both closing orders have filled; otherwise it stays
+    LIVE for a manual check. Returns the ids of the pairs closed.
+  """
+
+  closed_ids = []
+  for position in await get_open_positions(client):
+    legs = [(position["market_1"], position["order_m1_side"], position["order_m1_size"]),
+            (position["market_2"], position["order_m2_side"], position["order_m2_size"])]
+
+    # Cancel open orders
+    for market, _, _ in legs:
+      try:
+        await cancel_all_orders(client, market)
+      except ccxt.OrderNotFound:
+        pass
+
+    # Close both legs
+    statuses = []
+    for market, side, size in legs:
+      try:
+        statuses.append(await _close_leg(client, market, side, size))
+      except Exception as e:
+        print(f"Error closing {market}: {e}")
+        statuses.append("FAILED")
+
+    if statuses == ["FILLED", "FILLED"]:
+      closed_ids.append(position["id"])
+      print(f"Closed {position['market_1']} with {position['market_2']}")
+    else:
+      print(f"Warning: {position['market_1']} with {position['market_2']} left LIVE, close orders {statuses}")
+
+  # Record the exits
+  close_pair_positions(closed_ids)
+  return closed_ids
@@ -1,78 +1,152 @@
-import time
+import asyncio
 from datetime import datetime, timedelta, timezone
 
-import pandas as pd
+import ccxt.async_support as ccxt
 
-from constants import RESOLUTION, QUOTE_CURRENCY
+from constants import RESOLUTION, HISTORY_BARS, PAGE_LIMIT, OHLCV_REQUEST_COST
+from func_database import store_candles, get_candle_range, get_candles, get_candle_start, store_candle_start
+from func_downloader import download_markets, get_bucket
+from func_markets import get_market_cache
+from func_price_matrix import build_price_matrix, ohlcv_to_arrays
+from func_utils import clock_time
 
 
 # Get Recent Candles
 async def get_candles_recent(client, market):
-    close_prices = []
-    candles = await client.fetch_ohlcv(market=market, timeframe=RESOLUTION)
-    return await extract_close_prices_from_candles(candles, close_prices, market)
+    candles = await fetch_candles_historical(client, market)
+    return ohlcv_to_arrays(candles)[1]
+
+
+# Download the candle window of many markets through the store
+async def download_candles(client, markets, bars=HISTORY_BARS):
+    """
+        Every page request takes its own token from the client's bucket in fetch_candles_paginated, so
+        the per-market calls here only add concurrency and retries and take no token themselves.
+    """
+    return await download_markets(
+        client, list(markets), lambda client, market: fetch_candles_historical(client, market, bars), cost=0)
+
+
+# Get recent close prices for many markets, each market fetched once
+async def get_price_snapshot(client, markets):
+    candles, report = await download_candles(client, markets)
+    if report.failures:
+        print(report.summary())
+    return build_price_matrix({market: ohlcv_to_arrays(candles[market]) for market in candles}).drop_incomplete_tail()
 
 
 # Get Historical Candles
 async def get_candles_historical(client, market):
     close_prices = []
-    from_time = await get_from_time_for_candlesticks()
-    candles = await client.fetch_ohlcv(market, timeframe=RESOLUTION, since=int(from_time.timestamp()) * 1000,
-                                       limit=1000)
+    candles = await fetch_candles_historical(client, market)
     return await extract_close_prices_from_candles(candles, close_prices, market)
 
 
+# Get raw ohlcv rows for the statistics window
+async def fetch_candles_historical(client, market, bars=HISTORY_BARS):
+    """
+        Candles live in the local store. Only bars from the newest stored one onwards are
+        requested from the exchange, the newest being re-fetched as it may have still been forming.
+        The whole window is fetched again if the store does not reach back to its start, or to the
+        market's first bar for a market listed within the window.
+    """
+    from_time = await get_from_time_for_candlesticks(bars)
+    from_ms = int(from_time.timestamp()) * 1000
+    timeframe_ms = get_timeframe_ms()
+    first_stored, last_stored = get_candle_range(market, RESOLUTION, since=from_ms)
+    window_start = max(from_ms, get_candle_start(market, RESOLUTION) or 0)
+    if first_stored is not None and first_stored <= window_start + timeframe_ms:
+        await fetch_candles_paginated(client, market, since=last_stored)
+    else:
+        candles, _ = await fetch_candles_paginated(client, market, since=from_ms)
+        # The exchange has nothing earlier, so later runs only need to reach back to this bar
+        if candles and candles[0][0] > from_ms + timeframe_ms:
+            store_candle_start(market, RESOLUTION, candles[0][0])
+    return get_candles(market, RESOLUTION, since=from_ms)
+
+
+# Fetch any number of bars page by page
+async def fetch_candles_paginated(client, market, bars=None, since=None, until=None, limit=PAGE_LIMIT):
+    """
+        Walks `since` forward in pages of `limit` bars from either `bars` bars ago or `since` up to
+        `until` (ms, default now). Pages are requested concurrently and stored as they arrive. An exchange
+        that returns short pages is walked forward sequentially from the last bar it returned.
+        Each request waits for a token from the client's bucket. Errors are not retried here but raised,
+        so the caller's download retries the market as a whole.
+        Returns the deduplicated candles in time order and a list of (from, to) gaps.
+    """
+    timeframe_ms = get_timeframe_ms()
+    until = until or int(clock_time() * 1000)
+    if since is None:
+        since = until - (bars or HISTORY_BARS) * timeframe_ms
+    since -= since % timeframe_ms
+    page_span = limit * timeframe_ms
+    bucket = get_bucket(client)
+
+    async def fetch_page(page_start):
+        page_end = min(page_start + page_span, until)
+        rows = []
+        while page_start < page_end:
+            await bucket.acquire(OHLCV_REQUEST_COST)
+            page = await client.fetch_ohlcv(market, timeframe=RESOLUTION, since=page_start, limit=limit)
+            page = [c for c in page if c[0] < page_end]
+            if not page:
+                break
+            store_candles(market, RESOLUTION, page)
+            rows.extend(page)
+            page_start = page[-1][0] + timeframe_ms
+        return rows
+
+    pages = await asyncio.gather(*[fetch_page(page_start) for page_start in range(since, until, page_span)])
+
+    candles_by_time = {c[0]: c for page in pages for c in page}
+    candles = [candles_by_time[t] for t in sorted(candles_by_time)]
+    gaps = find_candle_gaps([c[0] for c in candles], timeframe_ms)
+    if gaps:
+        print(f"{market}: {len(gaps)} gaps in candle history, first at {gaps[0][0]}")
+    return candles, gaps
+
+
+# Missing bar ranges in a sorted list of candle timestamps
+def find_candle_gaps(timestamps, timeframe_ms):
+    return [(previous + timeframe_ms, current) for previous, current in zip(timestamps, timestamps[1:])
+            if current - previous > timeframe_ms]
+
+
 async def extract_close_prices_from_candles(candles, close_prices, market):
     for candle in candles:
         close_prices.append({"datetime": candle[0], market: candle[4]})
     return close_prices
 
 
-async def get_from_time_for_candlesticks():
-    # get the timestamp at 400*RESOLUTION ago
-    resolution_value = int(RESOLUTION[:-1])
-    resolution_unit = RESOLUTION[-1]
-    timestamp_ago = datetime.now(tz=timezone.utc)
-    if resolution_unit == "m":
-        timestamp_ago = datetime.now(tz=timezone.utc) - timedelta(minutes=400 * resolution_value)
-    elif resolution_unit == "h":
-        timestamp_ago = datetime.now(tz=timezone.utc) - timedelta(hours=400 * resolution_value)
-    elif resolution_unit == "d":
-        timestamp_ago = datetime.now(tz=timezone.utc) - timedelta(days=400 * resolution_value)
-    elif resolution_unit == "M":
-        timestamp_ago = datetime.now(tz=timezone.utc) - timedelta(days=400 * resolution_value * 30)
-    elif resolution_unit == "y":
-        timestamp_ago = datetime.now(tz=timezone.utc) - timedelta(days=400 * resolution_value * 365)
-    return timestamp_ago
+def get_timeframe_ms():
+    return ccxt.Exchange.parse_timeframe(RESOLUTION) * 1000
+
+
+async def get_from_time_for_candlesticks(bars=HISTORY_BARS):
+    # get the timestamp at bars*RESOLUTION ago
+    return datetime.fromtimestamp(clock_time(), tz=timezone.utc) - timedelta(milliseconds=bars * get_timeframe_ms())
 
 
 # Get Markets
 async def get_markets(client):
-    markets = await client.load_markets()
-    spot_markets = []
-    for market in markets.keys():
-        market_info = markets[market]
-        if ("status" in market_info["info"] and market_info["info"]["status"] == "TRADING") and market_info[
-            "type"] == "spot" and market_info["quote"] == QUOTE_CURRENCY:
-            spot_markets.append(market)
-    return spot_markets
+    market_cache = await get_market_cache(client)
+    return market_cache.symbols()
 
 
-async def get_historical_prices_for_all_markets(exchange):
+# Get close prices for all markets as a PriceMatrix
+async def get_historical_price_matrix(exchange, bars=HISTORY_BARS):
     active_markets = await get_markets(exchange)
-    df = pd.DataFrame(await get_candles_historical(exchange, active_markets[0]))
-    df.set_index("datetime", inplace=True)
-
-    for i, market in enumerate(active_markets[1:], start=1):
-        time.sleep(exchange.rateLimit / 1000)
-        df_add = pd.DataFrame(await get_candles_historical(exchange, market))
-        try:
-            df_add.set_index("datetime", inplace=True)
-            df = pd.merge(df, df_add, how="outer", on="datetime", copy=False)
-        except Exception as e:
-            print(f"Failed to add {market} - {e}")
-
-    nans = df.columns[df.isna().any()].tolist()
-    if nans:
-        df.drop(columns=nans, inplace=True)
-    return df
+    candles, report = await download_candles(exchange, active_markets, bars)
+    print(report.summary())
+
+    if not candles:
+        raise ValueError("No market prices downloaded")
+
+    series_by_market = {market: ohlcv_to_arrays(candles[market]) for market in active_markets if market in candles}
+    return build_price_matrix(series_by_market).drop_incomplete()
+
+
+async def get_historical_prices_for_all_markets(exchange):
+    price_matrix = await get_historical_price_matrix(exchange)
+    return price_matrix.to_frame()
@@ -0,0 +1,104 @@
+import asyncio
+from collections import defaultdict
+
+import numpy as np
+
+from constants import CANDLE_CLOSE_DELAY_SECONDS, SPREAD_WAKE_ZSCORE, WINDOW
+from func_cointegration import RollingZScore
+from func_utils import clock_time, clock_seconds
+
+# Wakes signal phases when a candle closes or when notified of a price move
+class SignalScheduler:
+    """
+        Each phase runs once at start, then again after every candle close for the configured
+        timeframe or as soon as notify() is called. Notifications arriving while a phase is
+        running are coalesced into a single re-run.
+    """
+
+    def __init__(self, timeframe_ms):
+        self.timeframe_ms = timeframe_ms
+        self.events = []
+        self.wake_reasons = defaultdict(int)
+
+    def seconds_to_next_close(self):
+        now_ms = clock_time() * 1000
+        return (self.timeframe_ms - now_ms % self.timeframe_ms) / 1000 + CANDLE_CLOSE_DELAY_SECONDS
+
+    def notify(self, reason="update"):
+        self.wake_reasons[reason] += 1
+        for event in self.events:
+            event.set()
+
+    async def run_phase(self, phase, after=None):
+        event = asyncio.Event()
+        event.set()
+        self.events.append(event)
+        while True:
+            try:
+                await asyncio.wait_for(event.wait(), timeout=clock_seconds(self.seconds_to_next_close()))
+            except asyncio.TimeoutError:
+                self.wake_reasons["candle_close"] += 1
+            event.clear()
+            await phase()
+            if after:
+                after()
+
+
+# Keeps a rolling ZScore per pair from streamed prices and wakes the scheduler when one moves
+class SpreadMonitor:
+    """
+        Each pair has a RollingZScore updated in constant time from every streamed price: a price in a
+        newer bar than the pair's last appends a spread, a revision of the current bar replaces it.
+        After each evaluation the pairs are re-seeded from the cache and their ZScores taken as a
+        baseline. A streamed price that moves any pair's ZScore by at least SPREAD_WAKE_ZSCORE from its
+        baseline, or a new bar, wakes the scheduler.
+    """
+
+    def __init__(self, scheduler, cache, pairs, window=WINDOW):
+        self.scheduler = scheduler
+        self.cache = cache
+        self.window = window
+        self.first_markets = pairs["first_market"].to_numpy()
+        self.second_markets = pairs["second_market"].to_numpy()
+        self.hedge_ratios = pairs["hedge_ratio"].to_numpy(dtype=np.float64)
+        self.pairs_by_market = defaultdict(list)
+        for k, (first_market, second_market) in enumerate(zip(self.first_markets, self.second_markets)):
+            self.pairs_by_market[first_market].append(k)
+            self.pairs_by_market[second_market].append(k)
+        self.rolling = [RollingZScore(window) for _ in range(len(self.hedge_ratios))]
+        self.bar_times = np.full(len(self.hedge_ratios), -1, dtype=np.int64)
+        self.baseline = np.full(len(self.hedge_ratios), np.nan)
+        cache.listeners.append(self.on_update)
+
+    def zscore(self, k):
+        return self.rolling[k].zscore
+
+    def rebase(self):
+        prices = self.cache.snapshot(self.pairs_by_market.keys())
+        if prices.shape[0] < self.window:
+            return
+        for k, (first_market, second_market) in enumerate(zip(self.first_markets, self.second_markets)):
+            if first_market in prices.column and second_market in prices.column:
+                spread = prices.series(first_market) - prices.series(second_market) * self.hedge_ratios[k]
+                self.rolling[k] = RollingZScore.from_spread(spread, self.window)
+                self.bar_times[k] = prices.timestamps[-1]
+                self.baseline[k] = self.rolling[k].zscore
+
+    def on_update(self, market, new_bar):
+        moved = False
+        for k in self.pairs_by_market.get(market, []):
+            first_market, second_market = self.first_markets[k], self.second_markets[k]
+            if not self.cache.closes.get(first_market) or not self.cache.closes.get(second_market):
+                continue
+            spread = self.cache.closes[first_market][-1] - self.hedge_ratios[k] * self.cache.closes[second_market][-1]
+            bar_time = max(self.cache.timestamps[first_market][-1], self.cache.timestamps[second_market][-1])
+            if bar_time > self.bar_times[k] or not self.rolling[k].count:
+                self.bar_times[k] = bar_time
+                z_score = self.rolling[k].update(spread)
+            else:
+                z_score = self.rolling[k].replace_last(spread)
+            moved = moved or abs(z_score - self.baseline[k]) >= SPREAD_WAKE_ZSCORE
+        if new_bar:
+            self.scheduler.notify("new_bar")
+        elif moved:
+            self.scheduler.notify("spread_move")
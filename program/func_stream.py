@@ -0,0 +1,155 @@
+import asyncio
+
+import ccxt.async_support as ccxt
+import numpy as np
+
+from constants import RESOLUTION, HISTORY_BARS, RETRY_BACKOFF_SECONDS
+from func_database import store_candles
+from func_price_matrix import build_price_matrix, ohlcv_to_arrays
+from func_public import download_candles
+
+# Cache fed by the running stream, None when streaming is off
+_bar_cache = None
+
+
+def get_bar_cache():
+    return _bar_cache
+
+
+# Latest bars per market, updated in place from streamed candles
+class BarCache:
+    """
+        Keeps up to max_bars (timestamp, close) bars per market. A streamed candle with the same
+        timestamp as the newest bar revises it; a later timestamp closes the newest bar, which is
+        then written to the candle store, and opens a new one. Listeners are called with
+        (market, new_bar) after every accepted update.
+    """
+
+    def __init__(self, max_bars=HISTORY_BARS, resolution=RESOLUTION):
+        self.max_bars = max_bars
+        self.resolution = resolution
+        self.timestamps = {}
+        self.closes = {}
+        self.last_candle = {}
+        self.listeners = []
+
+    def seed(self, market, candles):
+        timestamps, closes = ohlcv_to_arrays(candles[-self.max_bars:])
+        self.timestamps[market] = timestamps.tolist()
+        self.closes[market] = closes.tolist()
+        self.last_candle[market] = list(candles[-1]) if len(candles) else None
+
+    def update(self, market, candle):
+        timestamps = self.timestamps.setdefault(market, [])
+        closes = self.closes.setdefault(market, [])
+        timestamp, close = int(candle[0]), float(candle[4])
+        new_bar = not timestamps or timestamp > timestamps[-1]
+        if new_bar:
+            if self.last_candle.get(market) is not None:
+                store_candles(market, self.resolution, [self.last_candle[market]])
+            timestamps.append(timestamp)
+            closes.append(close)
+            if len(timestamps) > self.max_bars:
+                del timestamps[0], closes[0]
+        elif timestamp == timestamps[-1]:
+            closes[-1] = close
+        else:
+            return False
+        self.last_candle[market] = list(candle)
+        for listener in self.listeners:
+            listener(market, new_bar)
+        return new_bar
+
+    def series(self, market):
+        return np.asarray(self.closes.get(market, []), dtype=np.float64)
+
+    def snapshot(self, markets=None):
+        markets = self.timestamps.keys() if markets is None else markets
+        return build_price_matrix({
+            market: (np.asarray(self.timestamps[market], dtype=np.int64), self.series(market))
+            for market in markets if market in self.timestamps
+        }).drop_incomplete_tail()
+
+
+class ReplayFinished(Exception):
+    pass
+
+
+# Stand-in for a ccxt pro client that replays candles, for tests without a network
+class ReplayStream:
+    has = {"watchOHLCV": True, "watchOHLCVForSymbols": False}
+
+    def __init__(self, candles_by_market, interval=0.0):
+        self.pending = {market: list(candles) for market, candles in candles_by_market.items()}
+        self.interval = interval
+
+    async def watch_ohlcv(self, symbol, timeframe=RESOLUTION, since=None, limit=None, params={}):
+        await asyncio.sleep(self.interval)
+        if not self.pending.get(symbol):
+            raise ReplayFinished(symbol)
+        return [self.pending[symbol].pop(0)]
+
+    async def close(self):
+        return
+
+
+async def _watch_market(client, market, cache):
+    failures = 0
+    while True:
+        try:
+            candles = await client.watch_ohlcv(market, RESOLUTION)
+            failures = 0
+        except ReplayFinished:
+            return
+        except ccxt.NetworkError as e:
+            failures += 1
+            print(f"Stream error for {market} - {e}")
+            await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2 ** min(failures, 6))
+            continue
+        for candle in candles:
+            cache.update(market, candle)
+
+
+async def _watch_markets(client, markets, cache):
+    subscriptions = [[market, RESOLUTION] for market in markets]
+    failures = 0
+    while True:
+        try:
+            candles_by_symbol = await client.watch_ohlcv_for_symbols(subscriptions)
+            failures = 0
+        except ccxt.NetworkError as e:
+            failures += 1
+            print(f"Stream error - {e}")
+            await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2 ** min(failures, 6))
+            continue
+        for market, by_timeframe in candles_by_symbol.items():
+            for candle in by_timeframe.get(RESOLUTION, []):
+                cache.update(market, candle)
+
+
+# Subscribe to kline streams for the given markets and keep the bar cache current
+async def stream_markets(stream_client, markets, cache):
+    if stream_client.has.get("watchOHLCVForSymbols"):
+        await _watch_markets(stream_client, markets, cache)
+    else:
+        await asyncio.gather(*[_watch_market(stream_client, market, cache) for market in markets])
+
+
+# Seed a cache from REST history, make it the active cache and stream into it
+async def start_streaming(client, stream_client, markets, cache=None):
+    """
+        Runs until cancelled. While it runs, get_bar_cache() returns the cache so the
+        z-score code can read prices from memory instead of polling fetch_ohlcv.
+    """
+    global _bar_cache
+    cache = cache or BarCache()
+    candles, report = await download_candles(client, markets)
+    print(report.summary())
+    for market, market_candles in candles.items():
+        cache.seed(market, market_candles)
+
+    _bar_cache = cache
+    try:
+        await stream_markets(stream_client, list(candles), cache)
+    finally:
+        _bar_cache = None
@@ -0,0 +1,140 @@
+import itertools
+import os
+import random
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from constants import SWEEP_WINDOWS, SWEEP_ZSCORE_THRESHOLDS, SWEEP_MAX_HALF_LIVES, SWEEP_P_VALUE_CUTOFFS, \
+    SWEEP_SAMPLES, SWEEP_TRAIN_BARS, SWEEP_TEST_BARS, SWEEP_WORKERS, COINTEGRATION_CHUNK_SIZE
+from func_backtest import backtest_pairs
+from func_cointegration import calculate_cointegration_batch, cointegration_flags, half_life_mean_reversion_batch, \
+    rolling_zscores
+from func_database import store_sweep_results
+from func_pair_scan import pair_chunks, prescreen_pairs
+from func_worker_pool import attached_prices, price_worker_pool
+
+
+# Setting combinations to evaluate, the full grid or a random sample of it
+def sweep_configs(windows=SWEEP_WINDOWS, zscore_thresholds=SWEEP_ZSCORE_THRESHOLDS,
+                  max_half_lives=SWEEP_MAX_HALF_LIVES, p_value_cutoffs=SWEEP_P_VALUE_CUTOFFS, samples=SWEEP_SAMPLES,
+                  seed=None):
+    configs = list(itertools.product(windows, zscore_thresholds, max_half_lives, p_value_cutoffs))
+    if samples is not None and samples < len(configs):
+        configs = random.Random(seed).sample(configs, samples)
+    return configs
+
+
+# (train start, test start, test end) bar ranges stepping forward by one test period
+def walk_forward_folds(n_bars, train_bars=SWEEP_TRAIN_BARS, test_bars=SWEEP_TEST_BARS):
+    return [(test_start - train_bars, test_start, min(test_start + test_bars, n_bars))
+            for test_start in range(train_bars, n_bars - 1, test_bars)]
+
+
+# Test every candidate pair on one fold's training bars
+def _test_fold(train_start, test_start):
+    """
+        The Engle-Granger test, hedge ratio and half life of a pair do not depend on any swept setting,
+        so they are computed once per fold and every combination filters the same arrays.
+    """
+    train = np.asarray(attached_prices()[train_start:test_start])
+    first_indices, second_indices, _ = prescreen_pairs(train)
+    firsts, seconds, hedge_ratios, half_lives, p_values, t_stats = [], [], [], [], [], []
+    for first_index, shard in pair_chunks(first_indices, second_indices, COINTEGRATION_CHUNK_SIZE):
+        series_1 = train[:, first_index]
+        block = train[:, shard]
+        _, shard_hedge_ratios, intercepts, shard_t_stats, shard_p_values = \
+            calculate_cointegration_batch(series_1, block)
+        spreads = series_1[:, None] - block * shard_hedge_ratios - intercepts
+        firsts.append(np.full(len(shard), first_index))
+        seconds.append(shard)
+        hedge_ratios.append(shard_hedge_ratios)
+        half_lives.append(half_life_mean_reversion_batch(spreads))
+        p_values.append(shard_p_values)
+        t_stats.append(shard_t_stats)
+    if not firsts:
+        return tuple(np.array([]) for _ in range(6))
+    return tuple(np.concatenate(column) for column in (firsts, seconds, hedge_ratios, half_lives, p_values, t_stats))
+
+
+# Backtest every combination sharing one window on one fold's test bars
+def _backtest_fold(test_start, test_end, window, pair_stats, rules, train_bars):
+    first, second, hedge_ratios, half_lives, p_values, t_stats = pair_stats
+    first, second = first.astype(np.int64), second.astype(np.int64)
+    # Warm up the rolling ZScore on the bars before the test period, so trading starts at test_start
+    prices = np.asarray(attached_prices()[test_start - window + 1:test_end])
+    zscores = rolling_zscores(prices[:, first] - prices[:, second] * hedge_ratios, window)
+
+    rows = []
+    for zscore_thresh, max_half_life, p_value_cutoff in rules:
+        # Pairs the live scan would flag at this cutoff
+        cointegrated = cointegration_flags(t_stats, p_values, train_bars, p_value_cutoff).astype(bool)
+        selected = np.flatnonzero(cointegrated & (half_lives > 0) & (half_lives <= max_half_life))
+        result = backtest_pairs(prices, first[selected], second[selected], hedge_ratios[selected], window=window,
+                                zscore_thresh=zscore_thresh, max_half_life=None, zscores=zscores[:, selected])
+        summary = result.summary()
+        rows.append((window, zscore_thresh, max_half_life, p_value_cutoff, len(selected), summary["trades"],
+                     int(result.pairs["wins"].sum()), summary["pnl"], summary["max_drawdown"]))
+    return rows
+
+
+# Walk-forward sweep of strategy settings over a price matrix
+def run_parameter_sweep(prices, configs=None, workers=SWEEP_WORKERS, train_bars=SWEEP_TRAIN_BARS,
+                        test_bars=SWEEP_TEST_BARS, run_id=None, store=True):
+    """
+        Each fold selects pairs on train_bars bars and trades them on the following test_bars bars.
+        Pair tests run once per fold and ZScores once per fold and window; the combinations sharing a
+        window are then backtested together. Both stages are spread over a process pool that
+        memory-maps the price matrix. Rows go to the sweep_result table under run_id.
+        Returns the rows and the combinations ranked by total pnl.
+    """
+    configs = configs or sweep_configs()
+    run_id = run_id or uuid.uuid4().hex[:12]
+    values = np.asfortranarray(prices.values, dtype=np.float64)
+    timestamps = np.asarray(prices.timestamps, dtype=np.int64)
+    folds = walk_forward_folds(len(values), train_bars, test_bars)
+    if not folds:
+        raise ValueError(f"Need more than {train_bars} bars for a walk-forward sweep, got {len(values)}")
+    # The ZScore warm-up reads window - 1 bars before each test period, which must come from its training bars
+    invalid = sorted({window for window, *_ in configs if not 1 < window <= train_bars})
+    if invalid:
+        raise ValueError(f"Sweep windows must be between 2 and train_bars ({train_bars}), got {invalid}")
+    rules_by_window = {}
+    for window, zscore_thresh, max_half_life, p_value_cutoff in configs:
+        rules_by_window.setdefault(window, []).append((zscore_thresh, max_half_life, p_value_cutoff))
+    loosest_cutoff = max(p_value_cutoff for *_, p_value_cutoff in configs)
+    longest_half_life = max(max_half_life for _, _, max_half_life, _ in configs)
+    workers = workers or os.cpu_count() or 1
+    print(f"Sweeping {len(configs)} settings over {len(folds)} folds with {workers} workers")
+
+    def sweep(submit):
+        fold_stats = [submit(_test_fold, train_start, test_start) for train_start, test_start, _ in folds]
+        backtests = []
+        for fold, ((train_start, test_start, test_end), stats) in enumerate(zip(folds, fold_stats)):
+            # Only pairs that pass the loosest cutoff are worth sending to the backtests
+            stats = stats.result()
+            _, _, _, half_lives, p_values, t_stats = stats
+            keep = cointegration_flags(t_stats, p_values, test_start - train_start, loosest_cutoff).astype(bool) \
+                & (half_lives > 0) & (half_lives <= longest_half_life)
+            stats = tuple(column[keep] for column in stats)
+            for window, rules in rules_by_window.items():
+                backtests.append((fold, submit(_backtest_fold, test_start, test_end, window, stats, rules,
+                                               test_start - train_start)))
+        return [(fold, row) for fold, rows in backtests for row in rows.result()]
+
+    with price_worker_pool(values, workers) as executor:
+        rows = sweep(executor.submit)
+
+    results = pd.DataFrame(
+        [(run_id, *row[:4], fold, timestamps[folds[fold][0]], timestamps[folds[fold][1]],
+          timestamps[folds[fold][2] - 1], *row[4:]) for fold, row in rows],
+        columns=["run_id", "window", "zscore_thresh", "max_half_life", "p_value_cutoff", "fold", "train_start",
+                 "test_start", "test_end", "pairs", "trades", "wins", "pnl", "max_drawdown"],
+    )
+    if store:
+        store_sweep_results(results)
+    ranking = results.groupby(["window", "zscore_thresh", "max_half_life", "p_value_cutoff"], as_index=False).agg(
+        pnl=("pnl", "sum"), worst_fold=("pnl", "min"), trades=("trades", "sum"), wins=("wins", "sum"),
+    ).sort_values("pnl", ascending=False, ignore_index=True)
+    return results, ranking
@@ -1,3 +1,5 @@
+import asyncio
+import time
 from datetime import datetime, timedelta
 
 
@@ -25,3 +27,25 @@ def format_number(curr_num, match_num):
 def format_time(timestamp):
   return timestamp.replace(microsecond=0)
 
+
+# Clock used for trading decisions - wall time unless a simulated clock is installed
+_clock = None
+
+def set_clock(clock):
+  global _clock
+  _clock = clock
+
+def clock_time():
+  return _clock.time() if _clock else time.time()
+
+# Real seconds that pass while the clock advances by the given seconds
+def clock_seconds(seconds):
+  return _clock.to_wall_seconds(seconds) if _clock else seconds
+
+async def clock_sleep(seconds):
+  await asyncio.sleep(clock_seconds(seconds))
+
+
+# Value already at hand, as an awaitable that can be gathered alongside real requests
+async def as_awaitable(value):
+  return value
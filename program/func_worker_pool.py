@@ -0,0 +1,53 @@
+import contextlib
+import os
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+
+# Price matrix attached by each worker process
+_prices = None
+
+
+def _attach_prices(path):
+    global _prices
+    _prices = np.load(path, mmap_mode="r")
+
+
+def attached_prices():
+    return _prices
+
+
+# Runs submitted calls straight away in this process, for a single worker
+class _InProcessExecutor:
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+# Executor whose workers can read prices through attached_prices()
+@contextlib.contextmanager
+def price_worker_pool(prices, workers):
+    """
+        With more than one worker, the matrix is saved to a temporary .npy file that every worker
+        memory-maps rather than receiving pickled series. With one worker, calls run in this process
+        against the matrix itself. Either way submit returns a future.
+    """
+    global _prices
+    if workers == 1:
+        _prices = prices
+        try:
+            yield _InProcessExecutor()
+        finally:
+            _prices = None
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "prices.npy")
+        np.save(path, np.asfortranarray(prices, dtype=np.float64))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_prices, initargs=(path,)) as executor:
+            yield executor
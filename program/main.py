@@ -1,25 +1,69 @@
-import time
-
 import asyncio
+import json
+import os
 
 from basecommander import run_migrations
-from constants import ABORT_ALL_POSITIONS, FIND_COINTEGRATED, PLACE_TRADES, MANAGE_EXITS, MIGRATION_PATH, DATABASE_PATH
-from func_cointegration import find_cointegrated_markets_from_all_markets
-from func_connections import connect_exchange, close_client
-from func_database import store_cointegrated_markets
+from constants import ABORT_ALL_POSITIONS, FIND_COINTEGRATED, PLACE_TRADES, MANAGE_EXITS, MIGRATION_PATH, DATABASE_PATH, \
+    COINTEGRATION_INCREMENTAL, USE_STREAMING, RUN_BACKTEST, RUN_SWEEP, SWEEP_HISTORY_BARS, USE_MOCK_EXCHANGE
+from func_backtest import backtest_stored_pairs
+from func_connections import connect_exchange, connect_stream_exchange, close_client
+from func_database import store_cointegrated_markets, get_cointegrated_markets, insert_pair_positions, \
+    close_connections
 from func_entry_pairs import open_positions
 from func_exit_pairs import manage_trade_exits
 from func_messaging import send_message
+from func_metrics import stage, write_metrics
+from func_pair_scan import find_cointegrated_markets_from_all_markets, refresh_cointegrated_markets
 from func_private import abort_all_positions
-from func_public import get_historical_prices_for_all_markets
+from func_public import get_historical_prices_for_all_markets, get_historical_price_matrix, get_timeframe_ms
+from func_scheduler import SignalScheduler, SpreadMonitor
+from func_stream import BarCache, start_streaming
+from func_sweep import run_parameter_sweep
+
+
+# Move pairs left in bot_agents.json by earlier versions into the pair_position table
+def import_bot_agents_file(path="bot_agents.json"):
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        bot_agents = json.load(f)
+    live = [{**bot_agent, "pair_status": "LIVE"} for bot_agent in bot_agents if bot_agent.get("pair_status", "LIVE") == "LIVE"]
+    insert_pair_positions(live)
+    os.replace(path, path + ".imported")
+    print(f"Imported {len(live)} live pairs from {path}")
+
+
+# Exit phase
+async def run_exits(exchange):
+    try:
+        with stage("exits"):
+            await manage_trade_exits(exchange)
+    except Exception as e:
+        print("Error managing exiting positions: ", e)
+        send_message(f"Error managing exiting positions {e}")
+        exit(1)
+
+
+# Entry phase
+async def run_entries(exchange):
+    try:
+        with stage("entries"):
+            await open_positions(exchange)
+    except Exception as e:
+        print("Error trading pairs: ", e)
+        send_message(f"Error opening trades {e}")
+        exit(1)
 
 
 # MAIN FUNCTION
 async def main():
     exchange = None
+    stream_client = None
+    stream_task = None
     try:
         try:
             run_migrations(DATABASE_PATH, MIGRATION_PATH)
+            import_bot_agents_file()
 
         except Exception as e:
             print("Error running migrations: ", e)
@@ -47,15 +91,20 @@ async def main():
         if FIND_COINTEGRATED:
             try:
                 try:
-                    df_all_market_prices = await get_historical_prices_for_all_markets(exchange)
+                    with stage("market_prices"):
+                        df_all_market_prices = await get_historical_prices_for_all_markets(exchange)
                 except Exception as e:
                     print("Error constructing market prices: ", e)
                     send_message(f"Error constructing market prices {e}")
                     exit(1)
 
                 try:
-                    df_cointegrated_markets = find_cointegrated_markets_from_all_markets(df_all_market_prices)
-                    store_cointegrated_markets(df_cointegrated_markets)
+                    with stage("cointegration"):
+                        if COINTEGRATION_INCREMENTAL:
+                            df_cointegrated_markets = refresh_cointegrated_markets(df_all_market_prices)
+                        else:
+                            df_cointegrated_markets = find_cointegrated_markets_from_all_markets(df_all_market_prices)
+                            store_cointegrated_markets(df_cointegrated_markets)
                 except Exception as e:
                     print("Error saving cointegrated pairs: ", e)
                     send_message(f"Error saving cointegrated pairs {e}")
@@ -64,27 +113,77 @@ async def main():
                 del df_cointegrated_markets
                 del df_all_market_prices
 
-        while MANAGE_EXITS or PLACE_TRADES:
-            if MANAGE_EXITS:
-                try:
-                    await manage_trade_exits(exchange)
-                    time.sleep(1)
-                except Exception as e:
-                    print("Error managing exiting positions: ", e)
-                    send_message(f"Error managing exiting positions {e}")
-                    exit(1)
+        if RUN_BACKTEST:
+            try:
+                with stage("backtest"):
+                    backtest = await backtest_stored_pairs(exchange)
+                print(backtest.summary())
+                print(backtest.pairs.sort_values("pnl").to_string(index=False))
+            except Exception as e:
+                print("Error running backtest: ", e)
+                send_message(f"Error running backtest {e}")
+                exit(1)
 
-            # Place trades for opening positions
-            if PLACE_TRADES:
-                try:
-                    await open_positions(exchange)
-                except Exception as e:
-                    print("Error trading pairs: ", e)
-                    send_message(f"Error opening trades {e}")
-                    exit(1)
+        if RUN_SWEEP:
+            try:
+                with stage("sweep"):
+                    sweep_prices = await get_historical_price_matrix(exchange, SWEEP_HISTORY_BARS)
+                    _, ranking = run_parameter_sweep(sweep_prices)
+                print(ranking.head(10).to_string(index=False))
+            except Exception as e:
+                print("Error running parameter sweep: ", e)
+                send_message(f"Error running parameter sweep {e}")
+                exit(1)
+
+        scheduler = SignalScheduler(get_timeframe_ms())
+        spread_monitor = None
+        if USE_STREAMING and (MANAGE_EXITS or PLACE_TRADES):
+            try:
+                stream_client = await connect_stream_exchange()
+                pairs = get_cointegrated_markets()
+                stream_markets = sorted(set(pairs["first_market"]) | set(pairs["second_market"]))
+                bar_cache = BarCache()
+                spread_monitor = SpreadMonitor(scheduler, bar_cache, pairs)
+                stream_task = asyncio.create_task(start_streaming(exchange, stream_client, stream_markets, bar_cache))
+            except Exception as e:
+                print("Error starting market streams: ", e)
+                send_message(f"Error starting market streams {e}")
+                exit(1)
+
+        # Entry and exit run as independent tasks, woken on candle close or a streamed spread move
+        after = spread_monitor.rebase if spread_monitor else None
+        phases = []
+        if MANAGE_EXITS:
+            phases.append(scheduler.run_phase(lambda: run_exits(exchange), after))
+        if PLACE_TRADES:
+            phases.append(scheduler.run_phase(lambda: run_entries(exchange), after))
+        if phases and USE_MOCK_EXCHANGE:
+            # A replay ends once the simulated clock passes the last stored bar
+            try:
+                await asyncio.wait_for(asyncio.gather(*phases),
+                                       timeout=exchange.clock.to_wall_seconds(exchange.seconds_remaining()))
+            except asyncio.TimeoutError:
+                print(f"Replay finished: {exchange.summary()}")
+        elif phases:
+            await asyncio.gather(*phases)
     finally:
+        if stream_task:
+            stream_task.cancel()
+            try:
+                await stream_task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                print("Error in market streams: ", e)
+                send_message(f"Error in market streams {e}")
+        if stream_client:
+            await close_client(stream_client)
         if exchange:
             await close_client(exchange)
+        close_connections()
+        write_metrics()
 
 
-asyncio.run(main())
+# Guarded so cointegration worker processes can import this module
+if __name__ == "__main__":
+    asyncio.run(main())
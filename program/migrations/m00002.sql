@@ -0,0 +1,12 @@
+CREATE TABLE candle
+(
+    market     TEXT    NOT NULL,
+    resolution TEXT    NOT NULL, -- ccxt timeframe e.g. 1h
+    timestamp  INTEGER NOT NULL, -- Candle open time in milliseconds
+    open       REAL    NOT NULL,
+    high       REAL    NOT NULL,
+    low        REAL    NOT NULL,
+    close      REAL    NOT NULL,
+    volume     REAL    NOT NULL,
+    PRIMARY KEY (market, resolution, timestamp)
+) WITHOUT ROWID;
@@ -0,0 +1,39 @@
+-- cointegrated_pairs was first created by pandas to_sql without a key, rebuild it so pairs can be upserted
+CREATE TABLE IF NOT EXISTS cointegrated_pairs
+(
+    first_market  TEXT,
+    second_market TEXT,
+    hedge_ratio   REAL,
+    half_life     REAL
+);
+
+CREATE TABLE cointegrated_pairs_keyed
+(
+    first_market  TEXT NOT NULL,
+    second_market TEXT NOT NULL,
+    hedge_ratio   REAL NOT NULL,
+    half_life     REAL NOT NULL,
+    PRIMARY KEY (first_market, second_market)
+);
+
+INSERT OR REPLACE INTO cointegrated_pairs_keyed (first_market, second_market, hedge_ratio, half_life)
+SELECT first_market, second_market, hedge_ratio, half_life
+FROM cointegrated_pairs
+WHERE first_market IS NOT NULL AND second_market IS NOT NULL;
+
+DROP TABLE cointegrated_pairs;
+ALTER TABLE cointegrated_pairs_keyed RENAME TO cointegrated_pairs;
+
+-- Every pair tested by the incremental refresh and the data range it was tested on
+CREATE TABLE pair_test
+(
+    first_market  TEXT     NOT NULL,
+    second_market TEXT     NOT NULL,
+    cointegrated  INTEGER  NOT NULL, -- 1 when the pair met the cointegration and half life criteria
+    hedge_ratio   REAL,
+    half_life     REAL,
+    data_start    INTEGER  NOT NULL, -- First candle timestamp (ms) used by the test
+    data_end      INTEGER  NOT NULL, -- Last candle timestamp (ms) used by the test
+    tested_at     DATETIME NOT NULL DEFAULT (datetime('now')),
+    PRIMARY KEY (first_market, second_market)
+) WITHOUT ROWID;
@@ -0,0 +1,28 @@
+-- Live and historical pair trades, replacing bot_agents.json
+CREATE TABLE pair_position
+(
+    id            INTEGER PRIMARY KEY, -- Auto-incremented by SQLite automatically
+    market_1      TEXT     NOT NULL,
+    market_2      TEXT     NOT NULL,
+    hedge_ratio   REAL     NOT NULL,
+    z_score       REAL     NOT NULL, -- ZScore when the pair was opened
+    half_life     REAL     NOT NULL,
+    order_id_m1   TEXT,
+    order_m1_size REAL,
+    order_m1_side TEXT,
+    order_time_m1 TEXT,
+    order_id_m2   TEXT,
+    order_m2_size REAL,
+    order_m2_side TEXT,
+    order_time_m2 TEXT,
+    pair_status   TEXT     NOT NULL, -- LIVE while both legs are held, CLOSE once exited
+    comments      TEXT,
+    opened_at     DATETIME NOT NULL DEFAULT (datetime('now')),
+    closed_at     DATETIME          DEFAULT NULL
+);
+
+CREATE INDEX pair_position_status ON pair_position (pair_status);
+
+-- Partial indexes so "is this market in a live pair" only touches live rows
+CREATE INDEX pair_position_live_market_1 ON pair_position (market_1) WHERE pair_status = 'LIVE';
+CREATE INDEX pair_position_live_market_2 ON pair_position (market_2) WHERE pair_status = 'LIVE';
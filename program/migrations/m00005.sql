@@ -0,0 +1,23 @@
+-- Change counter per table so in-memory copies know when to reload
+CREATE TABLE table_version
+(
+    name    TEXT    NOT NULL PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+INSERT INTO table_version (name, version) VALUES ('cointegrated_pairs', 1);
+
+CREATE TRIGGER cointegrated_pairs_insert_version AFTER INSERT ON cointegrated_pairs
+BEGIN
+    UPDATE table_version SET version = version + 1 WHERE name = 'cointegrated_pairs';
+END;
+
+CREATE TRIGGER cointegrated_pairs_update_version AFTER UPDATE ON cointegrated_pairs
+BEGIN
+    UPDATE table_version SET version = version + 1 WHERE name = 'cointegrated_pairs';
+END;
+
+CREATE TRIGGER cointegrated_pairs_delete_version AFTER DELETE ON cointegrated_pairs
+BEGIN
+    UPDATE table_version SET version = version + 1 WHERE name = 'cointegrated_pairs';
+END;
@@ -0,0 +1,20 @@
+-- Walk-forward parameter sweep results, one row per setting combination and test fold
+CREATE TABLE sweep_result
+(
+    run_id         TEXT     NOT NULL, -- Shared by every row of one sweep
+    window         INTEGER  NOT NULL,
+    zscore_thresh  REAL     NOT NULL,
+    max_half_life  REAL     NOT NULL,
+    p_value_cutoff REAL     NOT NULL,
+    fold           INTEGER  NOT NULL,
+    train_start    INTEGER  NOT NULL, -- First candle timestamp (ms) the pairs were selected on
+    test_start     INTEGER  NOT NULL, -- First candle timestamp (ms) traded
+    test_end       INTEGER  NOT NULL, -- Last candle timestamp (ms) traded
+    pairs          INTEGER  NOT NULL, -- Pairs selected on the training bars
+    trades         INTEGER  NOT NULL,
+    wins           INTEGER  NOT NULL,
+    pnl            REAL     NOT NULL,
+    max_drawdown   REAL     NOT NULL,
+    created_at     DATETIME NOT NULL DEFAULT (datetime('now')),
+    PRIMARY KEY (run_id, window, zscore_thresh, max_half_life, p_value_cutoff, fold)
+) WITHOUT ROWID;
@@ -0,0 +1,8 @@
+-- First bar an exchange has for a market, recorded when a full window fetch starts later than requested
+CREATE TABLE candle_start
+(
+    market     TEXT    NOT NULL,
+    resolution TEXT    NOT NULL,
+    timestamp  INTEGER NOT NULL, -- Open time (ms) of the earliest bar available
+    PRIMARY KEY (market, resolution)
+) WITHOUT ROWID;
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from benchmark import make_cointegrated_series
+from constants import USD_PER_TRADE, WINDOW
+from func_backtest import backtest_pairs
+from func_cointegration import rolling_zscores
+
+
+def make_pairs(n_markets=40, n_bars=600, seed=3):
+    series = make_cointegrated_series(n_markets, n_bars)
+    prices = np.column_stack([closes for _, closes in series.values()])
+    rng = np.random.default_rng(seed)
+    # Pairs inside the cointegrated groups plus random ones, hedged at their OLS slope
+    first = np.concatenate([np.arange(0, n_markets // 2, 2), rng.integers(0, n_markets, 20)])
+    second = np.concatenate([np.arange(1, n_markets // 2, 2), rng.integers(0, n_markets, 20)])
+    keep = first != second
+    first, second = first[keep], second[keep]
+    hedge_ratios = np.array([np.polyfit(prices[:, j], prices[:, i], 1)[0] for i, j in zip(first, second)])
+    half_lives = rng.uniform(0, 40, len(first))
+    return prices, first, second, hedge_ratios, half_lives
+
+
+# Bar by bar replay of the entry and exit rules, one pair at a time
+def reference_trades(prices, first, second, hedge_ratios, half_lives, zscore_thresh, max_half_life, close_at_cross):
+    zscores = rolling_zscores(prices[:, first] - prices[:, second] * hedge_ratios, WINDOW)
+    n_bars = len(prices)
+    trades = []
+    for k in range(len(first)):
+        if not 0 < half_lives[k] <= max_half_life:
+            continue
+        bar = WINDOW - 1
+        while bar < n_bars:
+            if np.isnan(zscores[bar, k]) or abs(zscores[bar, k]) < zscore_thresh:
+                bar += 1
+                continue
+            entry, entry_z = bar, zscores[bar, k]
+            exit_bar = None
+            if close_at_cross:
+                for later in range(entry + 1, n_bars):
+                    if zscores[later, k] * np.sign(entry_z) < 0 and abs(zscores[later, k]) >= abs(entry_z):
+                        exit_bar = later
+                        break
+            still_open = exit_bar is None
+            exit_bar = n_bars - 1 if still_open else exit_bar
+            direction = 1 if entry_z < 0 else -1
+            pnl = direction * USD_PER_TRADE * ((prices[exit_bar, first[k]] / prices[entry, first[k]] - 1)
+                                               - (prices[exit_bar, second[k]] / prices[entry, second[k]] - 1))
+            trades.append((k, entry, exit_bar, pnl, still_open))
+            bar = exit_bar + 1
+    return trades
+
+
+@pytest.mark.parametrize("zscore_thresh, close_at_cross", [(1.5, True), (1.0, True), (2.0, False)])
+def test_backtest_matches_bar_by_bar_reference(zscore_thresh, close_at_cross):
+    prices, first, second, hedge_ratios, half_lives = make_pairs()
+    result = backtest_pairs(prices, first, second, hedge_ratios, half_lives, zscore_thresh=zscore_thresh,
+                            max_half_life=24, close_at_zscore_cross=close_at_cross)
+    expected = reference_trades(prices, first, second, hedge_ratios, half_lives, zscore_thresh, 24, close_at_cross)
+
+    trades = result.trades
+    got = list(zip(trades["pair"], trades["entry_bar"], trades["exit_bar"], trades["open"]))
+    assert got == [(k, entry, exit_bar, still_open) for k, entry, exit_bar, _, still_open in expected]
+    np.testing.assert_allclose(trades["pnl"], [pnl for *_, pnl, _ in expected], rtol=1e-12, atol=1e-12)
+    assert len(expected) > 10
+    assert result.summary()["pnl"] == pytest.approx(sum(pnl for *_, pnl, _ in expected))
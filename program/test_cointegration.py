@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pytest
+from statsmodels.tsa.adfvalues import mackinnonp
+from statsmodels.tsa.stattools import coint
+
+# constants reads exchange credentials on import, which these checks do not need
+os.environ.setdefault("BINANCE_API_KEY", "")
+os.environ.setdefault("BINANCE_API_SECRET", "")
+
+import func_cointegration
+from constants import WINDOW
+from func_cointegration import calculate_cointegration, calculate_cointegration_batch, calculate_zscore, \
+    mackinnon_pvalues, RollingZScore
+
+
+def make_block(n_bars=300, n_candidates=20, seed=7):
+    rng = np.random.default_rng(seed)
+    series_1 = np.cumsum(rng.normal(size=n_bars)) + 100
+    related = series_1[:, None] * rng.uniform(0.5, 2, n_candidates // 2) \
+        + rng.normal(0, 2, (n_bars, n_candidates // 2))
+    unrelated = np.cumsum(rng.normal(size=(n_bars, n_candidates - n_candidates // 2)), axis=0) + 100
+    return series_1, np.column_stack([related, unrelated])
+
+
+def test_batch_matches_statsmodels_coint():
+    series_1, block = make_block()
+    flags, hedge_ratios, _, t_stats, p_values = calculate_cointegration_batch(series_1, block)
+    for k in range(block.shape[1]):
+        t_stat, p_value, _ = coint(series_1, block[:, k])
+        flag, hedge_ratio, _ = calculate_cointegration(series_1, block[:, k])
+        assert t_stats[k] == pytest.approx(t_stat, abs=1e-8)
+        assert p_values[k] == pytest.approx(p_value, abs=1e-8)
+        assert hedge_ratios[k] == pytest.approx(hedge_ratio, rel=1e-8)
+        assert flags[k] == flag
+    assert flags[:10].sum() > 0 and flags[10:].sum() < 10
+
+
+@pytest.mark.parametrize("tables", [True, False])
+def test_pvalues_match_mackinnonp(monkeypatch, tables):
+    if not tables:
+        monkeypatch.setattr(func_cointegration, "_tau_maxs", None)
+    t_stats = np.linspace(-25, 5, 301)
+    expected = [mackinnonp(t_stat, regression="c", N=2) for t_stat in t_stats]
+    np.testing.assert_allclose(mackinnon_pvalues(t_stats), expected, atol=1e-12)
+
+
+def test_rolling_zscore_matches_calculate_zscore():
+    rng = np.random.default_rng(11)
+    # Long enough for several rebuilds of the running sums, at a level where rounding drift would show
+    spread = 1e4 + np.cumsum(rng.normal(size=500))
+    expected = calculate_zscore(spread).to_numpy()
+    rolling = RollingZScore()
+    for i, value in enumerate(spread):
+        z_score = rolling.update(value)
+        if i < WINDOW - 1:
+            assert np.isnan(z_score)
+        else:
+            assert z_score == pytest.approx(expected[i], abs=1e-6)
+
+
+def test_rolling_zscore_replace_last_revises_the_current_bar():
+    rng = np.random.default_rng(12)
+    spread = np.cumsum(rng.normal(size=100))
+    rolling = RollingZScore.from_spread(spread[:-1])
+    rolling.update(spread[-1] + 5)
+    revised = spread.copy()
+    for value in (spread[-1] - 3, spread[-1]):
+        revised[-1] = value
+        assert rolling.replace_last(value) == pytest.approx(calculate_zscore(revised).iloc[-1], abs=1e-9)
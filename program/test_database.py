@@ -0,0 +1,27 @@
+from constants import RESOLUTION
+from func_database import store_candles, get_candles, get_candle_range, get_candle_markets, delete_candles_after
+
+HOUR = 3_600_000
+
+
+def test_candles_round_trip_through_the_store(database):
+    candles = [[t * HOUR, 1.0 + t, 2.0 + t, 0.5 + t, 1.5 + t, 10.0 * t] for t in range(1, 6)]
+    store_candles("A/BTC", RESOLUTION, candles[::-1])
+    store_candles("B/BTC", RESOLUTION, candles[:2])
+
+    assert get_candles("A/BTC", RESOLUTION) == candles
+    assert get_candles("A/BTC", RESOLUTION, since=3 * HOUR) == candles[2:]
+    assert get_candle_range("A/BTC", RESOLUTION) == (HOUR, 5 * HOUR)
+    assert get_candle_range("A/BTC", RESOLUTION, since=6 * HOUR) == (None, None)
+    assert get_candles("A/BTC", "4h") == []
+    assert get_candle_markets(RESOLUTION) == ["A/BTC", "B/BTC"]
+
+
+def test_revised_bars_replace_the_stored_ones(database):
+    store_candles("A/BTC", RESOLUTION, [[HOUR, 1.0, 1.0, 1.0, 1.0, 5.0], [2 * HOUR, 1.0, 1.0, 1.0, 1.0, 5.0]])
+    # The newest bar was still forming when first fetched, and exchanges may send no volume
+    store_candles("A/BTC", RESOLUTION, [[2 * HOUR, 1.0, 1.2, 0.9, 1.1, None]])
+    assert get_candles("A/BTC", RESOLUTION) == [[HOUR, 1.0, 1.0, 1.0, 1.0, 5.0], [2 * HOUR, 1.0, 1.2, 0.9, 1.1, 0.0]]
+
+    delete_candles_after(RESOLUTION, HOUR)
+    assert get_candle_range("A/BTC", RESOLUTION) == (HOUR, HOUR)
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from benchmark import make_cointegrated_series
+from constants import COINTEGRATION_RETEST_BARS
+from func_database import get_pair_tests
+from func_pair_scan import find_cointegrated_markets_from_all_markets, refresh_cointegrated_markets
+
+COLUMNS = ["first_market", "second_market", "hedge_ratio", "half_life"]
+
+
+def market_prices(n_markets=16, n_bars=500):
+    series = make_cointegrated_series(n_markets, n_bars)
+    ts = next(iter(series.values()))[0]
+    return pd.DataFrame({market: closes for market, (_, closes) in series.items()}, index=ts)
+
+
+def assert_same_pairs(refreshed, full_scan):
+    refreshed = refreshed[COLUMNS].sort_values(COLUMNS[:2], ignore_index=True)
+    full_scan = full_scan[COLUMNS].sort_values(COLUMNS[:2], ignore_index=True)
+    assert len(full_scan) > 0
+    pd.testing.assert_frame_equal(refreshed, full_scan, check_dtype=False)
+
+
+def test_refresh_matches_a_full_rescan_as_bars_arrive(database):
+    prices = market_prices()
+    window = 400
+
+    first = prices.iloc[:window]
+    assert_same_pairs(refresh_cointegrated_markets(first, workers=1),
+                      find_cointegrated_markets_from_all_markets(first, workers=1))
+    assert len(get_pair_tests()) == 16 * 15 // 2
+
+    # Enough new bars for every pair to be re-tested on the moved window
+    moved = prices.iloc[COINTEGRATION_RETEST_BARS * 4:window + COINTEGRATION_RETEST_BARS * 4]
+    assert_same_pairs(refresh_cointegrated_markets(moved, workers=1),
+                      find_cointegrated_markets_from_all_markets(moved, workers=1))
+    assert (get_pair_tests()["data_end"] == moved.index[-1]).all()
+
+
+def test_refresh_skips_fresh_pairs_and_drops_delisted_markets(database):
+    prices = market_prices().iloc[:400]
+    refresh_cointegrated_markets(prices, workers=1)
+    tested_at = get_pair_tests().set_index(["first_market", "second_market"])["data_end"]
+
+    # One new bar is not enough to re-test, and the stored pairs of a removed market go away
+    delisted = prices.columns[0]
+    remaining = market_prices().iloc[1:401].drop(columns=delisted)
+    refreshed = refresh_cointegrated_markets(remaining, workers=1)
+    assert get_pair_tests().set_index(["first_market", "second_market"])["data_end"].equals(tested_at)
+    assert_same_pairs(refreshed, find_cointegrated_markets_from_all_markets(prices.drop(columns=delisted), workers=1))
@@ -0,0 +1,49 @@
+import numpy as np
+
+from func_cointegration import latest_pair_zscores
+from func_price_matrix import build_price_matrix
+from func_stream import BarCache
+
+HOUR = 3_600_000
+
+
+def candles(closes, start=0):
+    return [[start + i * HOUR, close, close, close, close, 1.0] for i, close in enumerate(closes)]
+
+
+def make_closes(n_bars=60, seed=3):
+    rng = np.random.default_rng(seed)
+    first = 100 + np.cumsum(rng.normal(size=n_bars))
+    return first, 2 * first + rng.normal(size=n_bars)
+
+
+def test_snapshot_drops_bars_not_every_market_has():
+    first, second = make_closes()
+    # The second market was fetched just before the last bar closed
+    prices = build_price_matrix({
+        "A/BTC": (np.arange(60, dtype=np.int64) * HOUR, first),
+        "B/BTC": (np.arange(59, dtype=np.int64) * HOUR, second[:59]),
+    })
+    assert np.isnan(prices.values[-1]).any()
+
+    trimmed = prices.drop_incomplete_tail()
+    assert trimmed.timestamps[-1] == 58 * HOUR
+    assert not np.isnan(trimmed.values).any()
+    z_score = latest_pair_zscores(trimmed.values, [0], [1], [0.5])
+    assert np.isfinite(z_score).all()
+
+
+def test_snapshot_without_a_complete_row_is_empty():
+    prices = build_price_matrix({"A/BTC": (np.array([0]), np.array([1.0])),
+                                 "B/BTC": (np.array([HOUR]), np.array([2.0]))}).drop_incomplete_tail()
+    assert prices.shape == (0, 2)
+
+
+def test_bar_cache_snapshot_ends_on_the_last_common_bar():
+    first, second = make_closes()
+    cache = BarCache(max_bars=100)
+    cache.seed("A/BTC", candles(first))
+    cache.seed("B/BTC", candles(second[:58]))
+    prices = cache.snapshot(["A/BTC", "B/BTC"])
+    assert prices.timestamps[-1] == 57 * HOUR
+    np.testing.assert_array_equal(prices.series("A/BTC"), first[:58])
@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+import ccxt.async_support as ccxt
+
+import func_downloader
+from constants import REQUEST_RETRIES
+from func_downloader import get_bucket
+from constants import RESOLUTION
+from func_database import get_candle_start
+from func_public import download_candles, fetch_candles_historical, fetch_candles_paginated
+
+HOUR = 3_600_000
+
+
+# Serves hourly bars from the listing time up to now, or fails every request with a network error
+class FakeExchange:
+    rateLimit = 0
+
+    def __init__(self, fail=False, listed=0):
+        self.fail = fail
+        self.listed = listed
+        self.calls = 0
+        self.since = []
+
+    async def fetch_ohlcv(self, symbol, timeframe=None, since=None, limit=None, params={}):
+        self.calls += 1
+        self.since.append(since)
+        if self.fail:
+            raise ccxt.RequestTimeout("timed out")
+        now = int(time.time() * 1000)
+        start = (max(since, self.listed) + HOUR - 1) // HOUR * HOUR
+        return [[t, 1.0, 1.0, 1.0, 1.0, 1.0] for t in range(start, now, HOUR)][:limit]
+
+
+def count_tokens(client):
+    bucket = get_bucket(client)
+    acquire = bucket.acquire
+    taken = []
+
+    async def counting_acquire(cost=1):
+        taken.append(cost)
+        await acquire(cost)
+
+    bucket.acquire = counting_acquire
+    return taken
+
+
+def test_every_page_request_takes_a_token(database):
+    for bars, limit, pages in ((50, 100, 1), (250, 100, 3)):
+        client = FakeExchange()
+        taken = count_tokens(client)
+        candles, gaps = asyncio.run(fetch_candles_paginated(client, "A/BTC", bars=bars, limit=limit))
+        assert client.calls == pages
+        assert sum(taken) == pages
+        assert len(candles) in (bars, bars + 1) and not gaps
+
+
+def test_failed_pages_are_retried_once_per_market(database, monkeypatch):
+    monkeypatch.setattr(func_downloader, "RETRY_BACKOFF_SECONDS", 0)
+    client = FakeExchange(fail=True)
+    taken = count_tokens(client)
+    # 400 bars in pages of 1000 is one page, 2500 bars is three
+    for bars, pages in ((400, 1), (2500, 3)):
+        client.calls = 0
+        taken.clear()
+        candles, report = asyncio.run(download_candles(client, ["A/BTC"], bars))
+        assert not candles and report.failures[0].attempts == REQUEST_RETRIES + 1
+        assert client.calls == sum(taken) == (REQUEST_RETRIES + 1) * pages
+        assert "Slowest: A/BTC" in report.summary().splitlines()[1]
+
+
+def test_new_listings_are_only_fetched_from_their_first_bar(database):
+    now = int(time.time() * 1000)
+    listed = now - now % HOUR - 100 * HOUR
+    client = FakeExchange(listed=listed)
+
+    # The first run asks for the whole window and records where the market's history starts
+    candles = asyncio.run(fetch_candles_historical(client, "NEW/BTC", bars=400))
+    assert candles[0][0] == listed and len(candles) in (100, 101)
+    assert get_candle_start("NEW/BTC", RESOLUTION) == listed
+
+    # Later runs only re-fetch from the newest stored bar
+    client.calls = 0
+    client.since.clear()
+    assert asyncio.run(fetch_candles_historical(client, "NEW/BTC", bars=400)) == candles
+    assert client.since == [candles[-1][0]]
+
+
+def test_markets_listed_before_the_window_record_no_start(database):
+    client = FakeExchange()
+    candles = asyncio.run(fetch_candles_historical(client, "OLD/BTC", bars=400))
+    assert len(candles) == 400 and get_candle_start("OLD/BTC", RESOLUTION) is None
+
+    client.since.clear()
+    asyncio.run(fetch_candles_historical(client, "OLD/BTC", bars=400))
+    assert client.since == [candles[-1][0]]
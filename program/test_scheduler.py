@@ -0,0 +1,108 @@
+import asyncio
+import contextlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import func_scheduler
+from constants import CANDLE_CLOSE_DELAY_SECONDS
+from func_cointegration import calculate_zscore
+from func_mock_exchange import SimulatedClock
+from func_scheduler import SignalScheduler, SpreadMonitor
+from func_stream import BarCache
+from func_utils import clock_time, set_clock
+
+HOUR = 3_600_000
+
+
+class RecordingScheduler:
+    def __init__(self):
+        self.reasons = []
+
+    def notify(self, reason="update"):
+        self.reasons.append(reason)
+
+
+def make_pair(n_bars=80, seed=5):
+    rng = np.random.default_rng(seed)
+    first = 100 + np.cumsum(rng.normal(size=n_bars))
+    return first, 0.5 * first + rng.normal(size=n_bars)
+
+
+def candle(bar, close):
+    return [bar * HOUR, close, close, close, close, 1.0]
+
+
+def test_streamed_zscores_match_calculate_zscore(database):
+    first, second = make_pair()
+    cache = BarCache(max_bars=200)
+    cache.seed("A/BTC", [candle(bar, close) for bar, close in enumerate(first[:40])])
+    cache.seed("B/BTC", [candle(bar, close) for bar, close in enumerate(second[:40])])
+    pairs = pd.DataFrame({"first_market": ["A/BTC"], "second_market": ["B/BTC"], "hedge_ratio": [2.0]})
+    monitor = SpreadMonitor(RecordingScheduler(), cache, pairs)
+    monitor.rebase()
+
+    for bar in range(40, len(first)):
+        # A revision of the forming bar first, then its final close, one market at a time
+        cache.update("A/BTC", candle(bar, first[bar] + 1))
+        cache.update("B/BTC", candle(bar, second[bar]))
+        cache.update("A/BTC", candle(bar, first[bar]))
+        expected = calculate_zscore(first[:bar + 1] - 2.0 * second[:bar + 1]).iloc[-1]
+        assert monitor.zscore(0) == pytest.approx(expected, abs=1e-9)
+    assert monitor.bar_times[0] == (len(first) - 1) * HOUR
+
+
+def run_scheduler(scheduler, phase, duration):
+    async def run():
+        task = asyncio.create_task(scheduler.run_phase(phase))
+        try:
+            await duration()
+        finally:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    asyncio.run(run())
+
+
+def test_phase_runs_at_start_and_coalesces_notifications(monkeypatch):
+    monkeypatch.setattr(func_scheduler, "clock_seconds", lambda seconds: 60.0)
+    scheduler = SignalScheduler(HOUR)
+    runs = []
+
+    async def phase():
+        runs.append(len(runs))
+        await asyncio.sleep(0.05)
+
+    async def notify_while_running():
+        await asyncio.sleep(0.01)
+        for _ in range(3):
+            scheduler.notify("spread_move")
+        await asyncio.sleep(0.2)
+
+    run_scheduler(scheduler, phase, notify_while_running)
+    # The start run, then one re-run for the three notifications that arrived during it
+    assert runs == [0, 1]
+    assert scheduler.wake_reasons == {"spread_move": 3}
+
+
+def test_phase_wakes_on_candle_close():
+    # One simulated hour passes in 0.1 seconds, starting 0.4 hours before a close
+    set_clock(SimulatedClock(1_700_000_000 - 1_700_000_000 % 3600 + 0.6 * 3600, speed=36000))
+    try:
+        scheduler = SignalScheduler(HOUR)
+        runs = []
+
+        async def phase():
+            runs.append(clock_time())
+
+        run_scheduler(scheduler, phase, lambda: asyncio.sleep(0.19))
+    finally:
+        set_clock(None)
+    assert len(runs) == 3
+    assert scheduler.wake_reasons["candle_close"] == 2
+    # Each re-run comes after the next candle close, by the close delay plus event loop latency
+    hours = [int(run // 3600) for run in runs]
+    assert hours[1:] == [hours[0] + 1, hours[0] + 2]
+    assert all(CANDLE_CLOSE_DELAY_SECONDS <= run % 3600 < 900 for run in runs[1:])
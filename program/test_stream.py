@@ -0,0 +1,86 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+
+from constants import RESOLUTION
+from func_database import get_candles
+from func_scheduler import SpreadMonitor
+from func_stream import BarCache, ReplayStream, stream_markets
+
+HOUR = 3_600_000
+
+
+# Records wake-ups and, like a phase finishing, rebases the monitor after each one
+class RecordingScheduler:
+    def __init__(self):
+        self.reasons = []
+        self.monitor = None
+
+    def notify(self, reason="update"):
+        self.reasons.append(reason)
+        if self.monitor:
+            self.monitor.rebase()
+
+
+def candle(bar, close):
+    return [bar * HOUR, close, close, close, close, 1.0]
+
+
+def make_closes(n_bars=40, seed=9):
+    rng = np.random.default_rng(seed)
+    first = 100 + np.cumsum(rng.normal(size=n_bars))
+    return {"A/BTC": first, "B/BTC": 0.5 * first + rng.normal(size=n_bars)}
+
+
+def seeded_cache(closes, seed_bars):
+    cache = BarCache(max_bars=100)
+    for market, market_closes in closes.items():
+        cache.seed(market, [candle(bar, close) for bar, close in enumerate(market_closes[:seed_bars])])
+    return cache
+
+
+def replay(closes, start_bar, forming_offset=0.01):
+    # Each bar arrives as a forming candle and then its final close
+    return {market: [row for bar in range(start_bar, len(market_closes))
+                     for row in (candle(bar, market_closes[bar] + forming_offset), candle(bar, market_closes[bar]))]
+            for market, market_closes in closes.items()}
+
+
+def test_replayed_stream_fills_the_cache_and_store(database):
+    closes = make_closes()
+    cache = seeded_cache(closes, 30)
+    asyncio.run(stream_markets(ReplayStream(replay(closes, 30)), list(closes), cache))
+
+    for market, market_closes in closes.items():
+        np.testing.assert_array_equal(cache.series(market), market_closes)
+        assert cache.timestamps[market][-1] == 39 * HOUR
+        # Bars are stored once they close, from the last seeded bar up to the one before the forming bar
+        stored = get_candles(market, RESOLUTION)
+        assert [row[0] for row in stored] == [bar * HOUR for bar in range(29, 39)]
+        assert [row[4] for row in stored] == list(market_closes[29:39])
+
+
+def test_stale_candles_are_ignored(database):
+    closes = make_closes()
+    cache = seeded_cache(closes, 30)
+    assert cache.update("A/BTC", candle(10, 1.0)) is False
+    assert cache.series("A/BTC")[-1] == closes["A/BTC"][29]
+
+
+def test_spread_monitor_wakes_on_new_bars_and_spread_moves(database):
+    closes = make_closes()
+    cache = seeded_cache(closes, 30)
+    scheduler = RecordingScheduler()
+    pairs = pd.DataFrame({"first_market": ["A/BTC"], "second_market": ["B/BTC"], "hedge_ratio": [2.0]})
+    monitor = scheduler.monitor = SpreadMonitor(scheduler, cache, pairs)
+    monitor.rebase()
+
+    # Small revisions of forming bars only wake the scheduler when a bar opens
+    asyncio.run(stream_markets(ReplayStream(replay(closes, 30)), list(closes), cache))
+    assert scheduler.reasons == ["new_bar"] * 20
+
+    # A large revision of the forming bar moves the spread by many standard deviations
+    scheduler.reasons.clear()
+    cache.update("A/BTC", candle(39, closes["A/BTC"][39] + 50))
+    assert scheduler.reasons == ["spread_move"]
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from func_price_matrix import PriceMatrix
+from func_sweep import run_parameter_sweep, walk_forward_folds
+
+
+def test_windows_longer_than_the_training_bars_are_rejected():
+    rng = np.random.default_rng(4)
+    prices = PriceMatrix(np.arange(600, dtype=np.int64) * 3_600_000, ["A/BTC", "B/BTC"],
+                         np.asfortranarray(100 + rng.random((600, 2))))
+    with pytest.raises(ValueError, match=r"\[401\]"):
+        run_parameter_sweep(prices, configs=[(21, 2.0, 24, 0.05), (401, 2.0, 24, 0.05)], train_bars=400,
+                            workers=1, store=False)
+
+
+def test_folds_step_forward_by_the_test_period():
+    assert walk_forward_folds(650, train_bars=400, test_bars=100) == [(0, 400, 500), (100, 500, 600), (200, 600, 650)]